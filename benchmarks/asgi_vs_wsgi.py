@@ -0,0 +1,103 @@
+"""Concurrent-request throughput of a running deployment.
+
+Drives GET /messages from --concurrency threads for --duration seconds while
+--uploaders threads keep posting large base64 images, i.e. the slow requests
+that pin a sync gunicorn worker. Run it once against the WSGI deployment and
+once against the ASGI one:
+
+    gunicorn --workers 3 chatbot_api.wsgi:application
+    gunicorn --workers 3 -k uvicorn.workers.UvicornWorker chatbot_api.asgi:application
+
+    python benchmarks/asgi_vs_wsgi.py --url http://127.0.0.1:8000 --label wsgi
+"""
+import argparse
+import base64
+import json
+import os
+import statistics
+import threading
+import time
+import urllib.request
+import uuid
+
+
+def call(url, method='GET', body=None, token=None, timeout=60):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['x-api-key'] = token
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    request = urllib.request.Request(url, data=data, method=method, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.status, response.read()
+
+
+def login(base_url):
+    username = f"bench_{uuid.uuid4().hex[:8]}"
+    credentials = {'username': username, 'password': 'bench-password-123'}
+    call(f"{base_url}/register", 'POST', credentials)
+    _, body = call(f"{base_url}/login", 'POST', credentials)
+    return json.loads(body)['token']
+
+
+def worker(stop, results, fn):
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            fn()
+            results.append(time.perf_counter() - start)
+        except Exception:
+            results.append(None)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--uploaders', type=int, default=3)
+    parser.add_argument('--image-mb', type=float, default=2.0)
+    parser.add_argument('--duration', type=float, default=20.0)
+    args = parser.parse_args()
+
+    token = login(args.url)
+    image = base64.b64encode(os.urandom(int(args.image_mb * 1024 * 1024))).decode('ascii')
+    upload = {'content': 'bench upload', 'image': {'name': 'bench.png', 'content': image}}
+
+    stop = threading.Event()
+    reads, uploads = [], []
+    threads = [
+        threading.Thread(target=worker, args=(stop, reads, lambda: call(f"{args.url}/messages?limit=50", token=token)))
+        for _ in range(args.concurrency)
+    ] + [
+        threading.Thread(target=worker, args=(stop, uploads, lambda: call(f"{args.url}/messages", 'POST', upload, token)))
+        for _ in range(args.uploaders)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    ok = [latency for latency in reads if latency is not None]
+    report = {
+        'label': args.label,
+        'concurrency': args.concurrency,
+        'uploaders': args.uploaders,
+        'duration_s': args.duration,
+        'reads_per_s': round(len(ok) / args.duration, 1),
+        'read_errors': len(reads) - len(ok),
+        'read_p50_ms': round(statistics.median(ok) * 1000, 1) if ok else None,
+        'read_p95_ms': round(percentile(ok, 95) * 1000, 1) if ok else None,
+        'uploads_per_s': round(len([u for u in uploads if u is not None]) / args.duration, 2),
+    }
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,333 @@
+"""Reproducible load and latency benchmark of the API, run entirely locally.
+
+Seeds a dataset (manage.py seed_chat), starts gunicorn on it and drives
+POST /register, POST /login, GET /users, GET /messages and POST /messages in
+turn, each from --concurrency client threads for --duration seconds after a
+--warmup. Prints one JSON report with throughput and p50/p95/p99 latency per
+endpoint and writes it to --output, so runs can be compared:
+
+    python benchmarks/load.py --db sqlite --output before.json
+    python benchmarks/load.py --db postgres --users 1000 --public 100000 \\
+        --private 100000 --images 0.1 --output after.json
+
+--db sqlite uses a fresh database file in the work directory. --db postgres
+uses the local server given by DB_HOST/DB_PORT/DB_USER/DB_PASSWORD (default
+127.0.0.1) and the database --db-name, which is FLUSHED before seeding: never
+point it at real data. Other settings (LOG_MODE, PUBLIC_TIMELINE_SIZE, ...)
+can be set in the environment and are recorded in the report. The client
+threads share the machine with the server: compare runs made on the same host.
+"""
+import argparse
+import base64
+import http.client
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ('register', 'login', 'users', 'get_messages', 'post_messages')
+SEED_PASSWORD = 'seed-password'
+SEED_PREFIX = 'seed_user_'
+# Settings that change the results, copied into the report when set
+RECORDED_SETTINGS = (
+    'LOG_MODE', 'LOG_SAMPLE_RATES', 'PUBLIC_TIMELINE_SIZE', 'AUTH_USER_CACHE_SIZE', 'HASHING_CONCURRENCY',
+    'IMAGE_STORAGE_MODE', 'ASYNC_VIEWS',
+)
+
+
+def server_env(args, workdir):
+    env = dict(os.environ)
+    env.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_api.settings')
+    env.update({
+        'DEBUG': 'False',
+        'DB_ENGINE': 'sqlite' if args.db == 'sqlite' else 'postgresql',
+        'DB_NAME': os.path.join(workdir, 'db.sqlite3') if args.db == 'sqlite' else args.db_name,
+        'MEDIA_ROOT': os.path.join(workdir, 'media'),
+        'PROFILE_DIR': os.path.join(workdir, 'profiles'),
+        # Throttling would turn most register/login calls into 429s
+        'LOGIN_IP_LIMIT': '0',
+        'REGISTER_IP_LIMIT': '0',
+    })
+    env.setdefault('DB_HOST', '127.0.0.1')
+    env.setdefault('LOG_MODE', 'structured')
+    env.setdefault('LOG_FILE', os.path.join(workdir, 'api.log'))
+    env.pop('PROMETHEUS_MULTIPROC_DIR', None)
+    return env
+
+
+def manage(env, *command):
+    subprocess.run([sys.executable, 'manage.py', *command], cwd=ROOT, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def prepare_database(args, env):
+    manage(env, 'migrate', '--noinput')
+    if args.db == 'postgres':
+        manage(env, 'flush', '--noinput')
+    manage(
+        env, 'seed_chat', '--users', str(args.users), '--public', str(args.public), '--private', str(args.private),
+        '--images', str(args.images), '--seed', str(args.seed), '--password', SEED_PASSWORD, '--prefix', SEED_PREFIX,
+    )
+
+
+def start_server(args, env, workdir):
+    if args.asgi:
+        worker = ['-k', 'uvicorn.workers.UvicornWorker', 'chatbot_api.asgi:application']
+    else:
+        worker = ['--worker-class', 'gthread', '--threads', str(args.threads), 'chatbot_api.wsgi:application']
+    command = [
+        sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f"127.0.0.1:{args.port}",
+        '--workers', str(args.workers), '--timeout', '120', *worker,
+    ]
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    server = subprocess.Popen(command, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"Server exited with {server.returncode}, see {log.name}")
+        try:
+            request('127.0.0.1', args.port, 'GET', '/users')
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise SystemExit(f"Server did not start within 60 s, see {log.name}")
+
+
+def request(host, port, method, path, body=None, token=None, connection=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['x-api-key'] = token
+    conn = connection or http.client.HTTPConnection(host, port, timeout=60)
+    conn.request(method, path, json.dumps(body) if body is not None else None, headers)
+    response = conn.getresponse()
+    data = response.read()
+    if connection is None:
+        conn.close()
+    return response.status, data
+
+
+def sample_image():
+    from PIL import Image, ImageDraw
+
+    image = Image.new('RGB', (800, 600), (40, 90, 160))
+    ImageDraw.Draw(image).ellipse((200, 100, 600, 500), fill=(240, 200, 40))
+    data = io.BytesIO()
+    image.save(data, 'JPEG', quality=85)
+    return {'name': 'bench.jpg', 'content': base64.b64encode(data.getvalue()).decode('ascii')}
+
+
+class Scenario:
+    """Builds the requests of one endpoint; `next` is called by one client
+    thread with its own random generator."""
+
+    def __init__(self, name, args, tokens, user_ids, image):
+        self.name = name
+        self.args = args
+        self.tokens = tokens
+        self.user_ids = user_ids
+        self.image = image
+
+    def next(self, rng):
+        token = rng.choice(self.tokens)
+        if self.name == 'register':
+            credentials = {'username': f"bench_{uuid.uuid4().hex[:12]}", 'password': 'bench-password-123'}
+            return 'POST', '/register', credentials, None
+        if self.name == 'login':
+            username = f"{SEED_PREFIX}{rng.randrange(self.args.users)}"
+            return 'POST', '/login', {'username': username, 'password': SEED_PASSWORD}, None
+        if self.name == 'users':
+            return 'GET', '/users', None, token
+        if self.name == 'get_messages':
+            return 'GET', f"/messages?limit={self.args.page_size}", None, token
+        body = {'content': f"Benchmark message {rng.randrange(10 ** 9)}"}
+        if rng.random() < self.args.private_share:
+            body['to'] = rng.choice(self.user_ids)
+        if self.image and rng.random() < self.args.post_images:
+            body['image'] = self.image
+        return 'POST', '/messages', body, token
+
+
+def client(port, scenario, seed, stop, measuring, results):
+    rng = random.Random(seed)
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while not stop.is_set():
+        method, path, body, token = scenario.next(rng)
+        start = time.perf_counter()
+        try:
+            status, _ = request('127.0.0.1', port, method, path, body, token, connection)
+        except (OSError, http.client.HTTPException):
+            status = 'error'
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        if measuring.is_set():
+            results.append((status, time.perf_counter() - start))
+    connection.close()
+
+
+def percentile(sorted_values, pct):
+    # Nearest rank
+    return sorted_values[max(0, min(len(sorted_values) - 1, -(-len(sorted_values) * pct // 100) - 1))]
+
+
+def run_scenario(args, scenario):
+    stop, measuring = threading.Event(), threading.Event()
+    results = []
+    threads = [
+        threading.Thread(target=client, args=(args.port, scenario, args.seed * 1000 + i, stop, measuring, results))
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    measuring.set()
+    started = time.perf_counter()
+    time.sleep(args.duration)
+    measuring.clear()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    ok = sorted(latency for status, latency in results if status != 'error' and status < 400)
+    report = {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'statuses': statuses,
+        'throughput_rps': round(len(ok) / elapsed, 1),
+    }
+    if ok:
+        report['latency_ms'] = {
+            'mean': round(statistics.fmean(ok) * 1000, 2),
+            'p50': round(percentile(ok, 50) * 1000, 2),
+            'p95': round(percentile(ok, 95) * 1000, 2),
+            'p99': round(percentile(ok, 99) * 1000, 2),
+            'max': round(ok[-1] * 1000, 2),
+        }
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--label', default='run')
+    parser.add_argument('--output', help="Write the JSON report to this file")
+    parser.add_argument('--db', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--db-name', default='chatbot_bench', help="PostgreSQL database (flushed!)")
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--public', type=int, default=20000)
+    parser.add_argument('--private', type=int, default=20000)
+    parser.add_argument('--images', type=float, default=0.1, help="Share of seeded messages with an image")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=16, help="gthread threads per worker")
+    parser.add_argument('--asgi', action='store_true', help="Serve chatbot_api.asgi with uvicorn workers")
+    parser.add_argument('--port', type=int, default=0, help="Server port (default: a free one)")
+    parser.add_argument('--concurrency', type=int, default=16, help="Client threads per endpoint")
+    parser.add_argument('--duration', type=float, default=15.0, help="Measured seconds per endpoint")
+    parser.add_argument('--warmup', type=float, default=3.0, help="Unmeasured seconds before each endpoint")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS), help=f"Subset of {','.join(ENDPOINTS)}")
+    parser.add_argument('--page-size', type=int, default=50, help="GET /messages ?limit=")
+    parser.add_argument('--private-share', type=float, default=0.3, help="Share of POSTed messages sent privately")
+    parser.add_argument('--post-images', type=float, default=0.0, help="Share of POSTed messages with an image")
+    parser.add_argument('--keep', action='store_true', help="Keep the work directory (database, logs)")
+    args = parser.parse_args()
+    args.port = args.port or free_port()
+    endpoints = [name for name in args.endpoints.split(',') if name]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix='chat-bench-')
+    env = server_env(args, workdir)
+    server = None
+    try:
+        print(f"Seeding {args.users} users, {args.public + args.private} messages ({args.db})...", file=sys.stderr)
+        started = time.perf_counter()
+        prepare_database(args, env)
+        seed_seconds = time.perf_counter() - started
+        server = start_server(args, env, workdir)
+
+        tokens = []
+        for i in range(min(args.users, max(args.concurrency, 1))):
+            status, body = request('127.0.0.1', args.port, 'POST', '/login',
+                                   {'username': f"{SEED_PREFIX}{i}", 'password': SEED_PASSWORD})
+            if status != 200:
+                raise SystemExit(f"Login of {SEED_PREFIX}{i} failed: {status} {body[:200]!r}")
+            tokens.append(json.loads(body)['token'])
+        _, body = request('127.0.0.1', args.port, 'GET', '/users?limit=500', token=tokens[0])
+        user_ids = [user['id'] for user in json.loads(body)['users']]
+        image = sample_image() if args.post_images > 0 else None
+
+        results = {}
+        for name in endpoints:
+            print(f"Running {name}...", file=sys.stderr)
+            results[name] = run_scenario(args, Scenario(name, args, tokens, user_ids, image))
+
+        report = {
+            'label': args.label,
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'database': args.db,
+            'dataset': {
+                'users': args.users, 'public': args.public, 'private': args.private,
+                'images': args.images, 'seed': args.seed, 'seed_seconds': round(seed_seconds, 1),
+            },
+            'server': {
+                'interface': 'asgi' if args.asgi else 'wsgi',
+                'workers': args.workers,
+                'threads': None if args.asgi else args.threads,
+                'settings': {name: env[name] for name in RECORDED_SETTINGS if name in env},
+            },
+            'load': {
+                'concurrency': args.concurrency, 'duration_s': args.duration, 'warmup_s': args.warmup,
+                'page_size': args.page_size, 'private_share': args.private_share, 'post_images': args.post_images,
+            },
+            'endpoints': results,
+        }
+        output = json.dumps(report, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        if args.keep:
+            print(f"Work directory kept: {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User, Message
+from .models import User, Message, ArchivedMessage, ImageBlob
 
 admin.site.register(User, UserAdmin)
 
@@ -8,4 +8,15 @@ admin.site.register(User, UserAdmin)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['content', 'from_user', 'to_user', 'created_at']
     list_filter = ['created_at', 'from_user', 'to_user']
-    search_fields = ['content', 'from_user__username', 'to_user__username']
\ No newline at end of file
+    search_fields = ['content', 'from_user__username', 'to_user__username']
+
+@admin.register(ArchivedMessage)
+class ArchivedMessageAdmin(admin.ModelAdmin):
+    list_display = ['content', 'from_user', 'to_user', 'created_at', 'archived_at']
+    list_filter = ['created_at', 'archived_at']
+    search_fields = ['content', 'from_user__username', 'to_user__username']
+
+@admin.register(ImageBlob)
+class ImageBlobAdmin(admin.ModelAdmin):
+    list_display = ['name', 'refcount', 'created_at']
+    search_fields = ['name']
@@ -2,4 +2,12 @@ from django.apps import AppConfig
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'chat'
\ No newline at end of file
+    name = 'chat'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from . import signals  # noqa: F401
+        from .metrics import install_query_counter
+        from .profiling import install_query_capture
+        connection_created.connect(install_query_counter)
+        connection_created.connect(install_query_capture)
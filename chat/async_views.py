@@ -0,0 +1,383 @@
+"""Async counterparts of the chat views, served when running under ASGI.
+
+Database access goes through Django's async ORM. Password hashing runs on
+the shared hashing executor (chat.hashing); other blocking work (base64
+decoding) runs on a bounded thread pool, so it never stalls the event loop.
+"""
+import asyncio
+import json
+import logging
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import authenticate, get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connections
+from django.http import JsonResponse, StreamingHttpResponse
+from .authentication import create_jwt_token, jwt_required
+from .conditional import feed_etag, not_modified, set_validators
+from .events import RecentIds, format_event, hub
+from .hashing import Overloaded, hashing
+from .models import Message
+from .pagination import InvalidCursor, parse_limit
+from .timeline import public_timeline
+from .uploads import UploadTooLarge, read_multipart_message
+from .throttling import client_ip, login_ip_throttle, login_username_throttle, register_ip_throttle
+from .views import (
+    FEED_CHUNK_SIZE, _archive_boundary, _archive_window_rows, _conversation, _fall_through, _feed_heads,
+    _in_archive_window, _merge_feed, _newest, _resolve_position, _serialize_feed_row, _stream_feed, _thread_head, _thread_messages, _users_page, _users_query, _users_etag, _visible_messages, decode_image,
+    overloaded_response, throttled_response, upload_too_large_response,
+)
+
+logger = logging.getLogger('chat.views')
+
+User = get_user_model()
+
+_blocking_pool = ThreadPoolExecutor(
+    max_workers=settings.ASYNC_BLOCKING_THREADS,
+    thread_name_prefix='chat-blocking',
+)
+
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking callable on the bounded pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_blocking_pool, partial(func, *args, **kwargs))
+
+
+def async_api_view(methods):
+    """Minimal async equivalent of api_view/require_http_methods + csrf_exempt
+    (the Django 4.2 decorators only wrap sync views)."""
+    def decorator(view_func):
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return JsonResponse({'error': f'Method "{request.method}" not allowed.'}, status=405)
+            return await view_func(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+@async_api_view(['POST'])
+async def register(request):
+    logger.info("=== REGISTER REQUEST (async) ===")
+
+    try:
+        data = json.loads(request.body)
+        username = data.get('username')
+        password = data.get('password')
+
+        logger.info("Registration attempt for username: %s", username)
+
+        if not username or not password:
+            logger.warning("Missing credentials - username: %s, password: %s", bool(username), bool(password))
+            return JsonResponse({
+                'success': False,
+                'error': 'Username and password are required'
+            }, status=400)
+
+        ip = client_ip(request)
+        if await sync_to_async(register_ip_throttle.is_blocked)(ip):
+            logger.warning("Registration throttled for IP %s", ip)
+            return throttled_response(register_ip_throttle.window, success_flag=True)
+
+        if await User.objects.filter(username=username).aexists():
+            logger.warning("Registration failed - username '%s' already exists", username)
+            return JsonResponse({
+                'success': False,
+                'error': 'Username already exists'
+            }, status=400)
+
+        await sync_to_async(register_ip_throttle.hit)(ip)
+        # Same as create_user(), with the PBKDF2 hashing on the hashing executor
+        user = User(username=User.normalize_username(username))
+        user.password = await hashing.arun(make_password, password)
+        await user.asave()
+        logger.info("User '%s' registered successfully with ID: %s", username, user.id)
+        return JsonResponse({'success': True})
+
+    except Overloaded as e:
+        logger.warning("Registration refused, hashing executor overloaded: %s", e)
+        return overloaded_response(success_flag=True)
+
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in register request: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON'
+        }, status=400)
+    except Exception as e:
+        logger.error("Unexpected error in register: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+@async_api_view(['POST'])
+async def login(request):
+    logger.info("=== LOGIN REQUEST (async) ===")
+
+    try:
+        data = json.loads(request.body)
+        username = data.get('username')
+        password = data.get('password')
+
+        logger.info("Login attempt for username: %s", username)
+
+        if not username or not password:
+            logger.warning("Missing credentials - username: %s, password: %s", bool(username), bool(password))
+            return JsonResponse({'error': 'Username and password are required'}, status=400)
+
+        ip = client_ip(request)
+        for throttle, ident in ((login_ip_throttle, ip), (login_username_throttle, username)):
+            if await sync_to_async(throttle.is_blocked)(ident):
+                logger.warning("Login throttled (%s) for username '%s' from IP %s", throttle.scope, username, ip)
+                return throttled_response(throttle.window)
+        await sync_to_async(login_ip_throttle.hit)(ip)
+
+        user = await hashing.arun(authenticate, username=username, password=password)
+        if user:
+            await sync_to_async(login_username_throttle.reset)(username)
+            token = create_jwt_token(user)
+            logger.info("Login successful for user '%s' (ID: %s)", username, user.id)
+            return JsonResponse({'token': token})
+        else:
+            await sync_to_async(login_username_throttle.hit)(username)
+            logger.warning("Login failed for username '%s' - invalid credentials", username)
+            return JsonResponse({'error': 'Invalid credentials'}, status=401)
+
+    except Overloaded as e:
+        logger.warning("Login refused, hashing executor overloaded: %s", e)
+        return overloaded_response()
+
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in login request: %s", e)
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    except Exception as e:
+        logger.error("Unexpected error in login: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@async_api_view(['GET'])
+@jwt_required
+async def users(request):
+    logger.info("=== USERS LIST REQUEST (async) from user %s (ID: %s) ===", request.user.username, request.user.id)
+
+    try:
+        queryset, limit = _users_query(request.GET)
+    except InvalidCursor:
+        logger.warning("Invalid users cursor: %s", request.GET.get('after'))
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        etag = await sync_to_async(_users_etag)(request)
+        response = not_modified(request, etag)
+        if response is not None:
+            logger.info("Users not modified for user %s", request.user.id)
+            return response
+        return set_validators(JsonResponse(_users_page([user async for user in queryset], limit)), etag)
+    except Exception as e:
+        logger.error("Error retrieving users list: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@async_api_view(['GET', 'POST'])
+@jwt_required
+async def messages_handler(request):
+    logger.info("=== MESSAGES REQUEST (%s, async) from user %s (ID: %s) ===", request.method, request.user.username, request.user.id)
+
+    if request.method == 'POST':
+        return await send_message(request)
+    return await get_messages(request)
+
+
+async def send_message(request):
+    try:
+        if request.content_type.startswith('multipart/form-data'):
+            # The ASGI handler has already spooled the body to disk; parsing
+            # it is blocking file I/O.
+            content, to_user_id, image_file = await run_blocking(read_multipart_message, request)
+            image_data = None
+        else:
+            data = json.loads(request.body)
+            content = data.get('content')
+            to_user_id = data.get('to')
+            image_data = data.get('image')
+            image_file = None
+
+        if not content:
+            logger.warning("Message rejected - empty content")
+            return JsonResponse({
+                'success': False,
+                'error': 'Content is required'
+            }, status=400)
+
+        message = Message(content=content, from_user=request.user)
+
+        if to_user_id:
+            try:
+                message.to_user = await User.objects.aget(id=to_user_id)
+            except User.DoesNotExist:
+                logger.warning("Recipient user not found: ID %s", to_user_id)
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Recipient user not found'
+                }, status=400)
+
+        try:
+            image_file = image_file or await run_blocking(decode_image, image_data)
+        except ValueError as e:
+            logger.error("Image processing failed: %s", e)
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid image data'
+            }, status=400)
+        if image_file:
+            message.image = image_file
+
+        await message.asave()
+        logger.info("Message saved successfully - ID: %s", message.id)
+        return JsonResponse({'success': True})
+
+    except UploadTooLarge as e:
+        logger.warning("Upload rejected - %s bytes exceeds %s", e, settings.MESSAGE_UPLOAD_MAX_BYTES)
+        return upload_too_large_response()
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in send message: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON'
+        }, status=400)
+    except Exception as e:
+        logger.error("Unexpected error in send message: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+
+async def get_messages(request):
+    before = request.GET.get('before')
+    since = request.GET.get('since')
+    if before and since:
+        return JsonResponse({'error': 'Use either before or since, not both'}, status=400)
+    peer = request.GET.get('with')
+    if peer is not None and not peer.isdigit():
+        return JsonResponse({'error': f'Invalid user id: {peer}'}, status=400)
+
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        position = await sync_to_async(_resolve_position)(before or since) if (before or since) else None
+    except InvalidCursor:
+        logger.warning("Invalid cursor: %s", before or since)
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    try:
+        peer_id = int(peer) if peer is not None else None
+        if peer_id is not None:
+            thread = _conversation(request.user, peer_id)
+            newest = await sync_to_async(_thread_head)(thread)
+        else:
+            heads = await sync_to_async(_feed_heads)(request.user)
+            newest = _newest(heads)
+        etag = feed_etag(request, newest)
+        response = not_modified(request, etag)
+        if response is not None:
+            logger.info("Messages not modified for user %s", request.user.id)
+            return response
+        
+        direction = 'since' if since else 'before'
+        boundary = _archive_boundary()
+        if _in_archive_window(position, boundary):
+            rows = await sync_to_async(list)(_archive_window_rows(request.user, peer_id, position, direction, limit + 1))
+        else:
+            if peer_id is not None:
+                public_rows = None
+                queryset = _thread_messages(thread, position, direction, limit + 1)
+            else:
+                public_rows = await sync_to_async(public_timeline.page)(heads['public'], position, direction, limit + 1)
+                queryset = _visible_messages(request.user, position, direction, limit + 1, public=public_rows is None)
+            rows = [row async for row in queryset.aiterator(chunk_size=FEED_CHUNK_SIZE)]
+            if public_rows is not None:
+                rows = list(_merge_feed(public_rows, rows, direction, limit + 1))
+            # Only pages reaching past the archive boundary read the archive
+            if boundary is not None and direction == 'before' and (
+                len(rows) <= limit or (rows and rows[-1]['created_at'] < boundary)
+            ):
+                rows = await sync_to_async(list)(
+                    _fall_through(iter(rows), request.user, peer_id, position, limit + 1, boundary)
+                )
+    except Exception as e:
+        logger.error("Error retrieving messages: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+
+    # At most limit + 1 rows are held; encoding is pure CPU
+    async def stream():
+        for chunk in _stream_feed(iter(rows), limit, direction, position, first_page=not (before or since)):
+            yield chunk
+    return set_validators(StreamingHttpResponse(stream(), content_type='application/json'), etag)
+
+
+
+@async_api_view(['GET'])
+@jwt_required
+async def message_stream(request):
+    """Server-Sent Events, see views.message_stream. Under ASGI a sync
+    generator would be consumed whole before anything is sent; this one is
+    an async generator that waits for events on the event loop."""
+    logger.info("=== MESSAGE STREAM (async) for user %s (ID: %s) ===", request.user.username, request.user.id)
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    position = None
+    if last_event_id:
+        try:
+            position = await sync_to_async(_resolve_position)(last_event_id)
+        except InvalidCursor:
+            logger.warning("Unknown Last-Event-ID %s, not replaying", last_event_id)
+
+    # Subscribe before replaying so nothing committed in between is missed
+    subscriber = hub.subscribe(request.user.id, asyncio.get_running_loop())
+    response = StreamingHttpResponse(
+        _event_stream(request.user, subscriber, position),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def _event_stream(user, subscriber, position):
+    heartbeat = settings.SSE_HEARTBEAT_SECONDS
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.SSE_MAX_SECONDS
+    sent = RecentIds(settings.SSE_SENT_IDS)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n".encode('utf-8')
+
+        if position is not None:
+            since = (position[0] - timedelta(seconds=settings.FEED_SETTLE_SECONDS), 0)
+            replay = _visible_messages(user, since, 'since', settings.SSE_REPLAY_LIMIT)
+            async for row in replay.aiterator(chunk_size=FEED_CHUNK_SIZE):
+                if row['id'] > position[1] and sent.add(row['id']):
+                    yield format_event(row['id'], json.dumps(_serialize_feed_row(row)))
+        # Do not hold a database connection while idling on the queue
+        await sync_to_async(connections.close_all)()
+
+        while not subscriber.closed and loop.time() < deadline:
+            try:
+                event_id, data = await asyncio.wait_for(subscriber.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            if sent.add(event_id):
+                yield format_event(event_id, data)
+    finally:
+        hub.unsubscribe(subscriber)
@@ -1,9 +1,16 @@
+import asyncio
+import copy
+import hashlib
 import jwt
 import logging
+import threading
+import time
+from collections import OrderedDict
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.http import JsonResponse
 from functools import wraps
+from . import metrics
 
 User = get_user_model()
 logger = logging.getLogger('chat.authentication')
@@ -25,29 +32,201 @@ def decode_jwt_token(token):
     except jwt.InvalidTokenError:
         return None
 
+class UserCache:
+    """In-process LRU + TTL cache of users resolved from token payloads.
+
+    Entries are dropped by the User save/delete signals (chat.signals) in
+    the process that made the change; other workers pick up the change when
+    the TTL expires. Lookups, evictions and size are exported on /metrics.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                    metrics.auth_user_cache_size.set(len(self._entries))
+                self.misses += 1
+                metrics.auth_user_cache_lookups.labels('miss').inc()
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            metrics.auth_user_cache_lookups.labels('hit').inc()
+            # Each request gets its own instance
+            return copy.copy(entry[1])
+
+    def set(self, user_id, user):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[user_id] = (time.monotonic() + self.ttl, copy.copy(user))
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+                metrics.auth_user_cache_evictions.inc()
+            metrics.auth_user_cache_size.set(len(self._entries))
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            metrics.auth_user_cache_size.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            metrics.auth_user_cache_size.set(0)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+class RejectedTokens:
+    """Remember tokens that keep failing so they are refused without
+    verifying the signature or querying the database again."""
+
+    def __init__(self, threshold, ttl, maxsize=10000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._failures = OrderedDict()
+        self._lock = threading.Lock()
+        self.short_circuits = 0
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def is_rejected(self, token):
+        key = self._key(token)
+        with self._lock:
+            entry = self._failures.get(key)
+            if entry is None:
+                return False
+            count, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._failures[key]
+                return False
+            if count >= self.threshold:
+                self.short_circuits += 1
+                metrics.auth_rejected_short_circuits.inc()
+                return True
+            return False
+
+    def record_failure(self, token):
+        if self.threshold <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            count = self._failures.get(key, (0, 0))[0]
+            self._failures[key] = (count + 1, time.monotonic() + self.ttl)
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.maxsize:
+                self._failures.popitem(last=False)
+
+
+user_cache = UserCache(settings.AUTH_USER_CACHE_SIZE, settings.AUTH_USER_CACHE_TTL)
+rejected_tokens = RejectedTokens(settings.AUTH_REJECT_THRESHOLD, settings.AUTH_REJECT_TTL)
+
+def _token_payload(request):
+    """Return (token, payload, None) for a valid x-api-key token, (token, None, error response) otherwise"""
+    token = request.headers.get('x-api-key')
+    logger.debug("JWT Auth check for %s", request.path)
+    
+    if not token:
+        logger.warning("Missing token for %s", request.path)
+        return token, None, JsonResponse({'error': 'Token required'}, status=401)
+    
+    if rejected_tokens.is_rejected(token):
+        return token, None, JsonResponse({'error': 'Invalid token'}, status=401)
+    
+    logger.debug("Token received: %s...", token[:20])
+    payload = decode_jwt_token(token)
+    if not payload:
+        logger.warning("Invalid token for %s", request.path)
+        rejected_tokens.record_failure(token)
+        return token, None, JsonResponse({'error': 'Invalid token'}, status=401)
+    return token, payload, None
+
+def _user_error(token, payload, user):
+    """Error response when the token's user is missing or deactivated"""
+    if user is None:
+        logger.error("User not found for token payload: %s", payload)
+        rejected_tokens.record_failure(token)
+        return JsonResponse({'error': 'User not found'}, status=401)
+    if not user.is_active:
+        logger.warning("Inactive user %s rejected", user.id)
+        rejected_tokens.record_failure(token)
+        return JsonResponse({'error': 'User inactive'}, status=401)
+    return None
+
+def _login_user(request, user):
+    request.user = user
+    # Let DRF's api_view keep this user instead of re-authenticating
+    # the request as anonymous.
+    request._force_auth_user = user
+    logger.debug("JWT auth successful for user: %s (ID: %s)", user.username, user.id)
+
 def jwt_required(view_func):
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            token, payload, error = _token_payload(request)
+            if error:
+                return error
+            user_id = payload['user_id']
+            user = user_cache.get(user_id)
+            if user is None:
+                user = await User.objects.filter(id=user_id).afirst()
+                if user is not None:
+                    user_cache.set(user_id, user)
+            error = _user_error(token, payload, user)
+            if error:
+                return error
+            _login_user(request, user)
+            return await view_func(request, *args, **kwargs)
+        return async_wrapper
+    
     @wraps(view_func)
     def wrapper(request, *args, **kwargs):
-        token = request.headers.get('x-api-key')
-        logger.debug(f"JWT Auth check for {request.path}")
-        
-        if not token:
-            logger.warning(f"Missing token for {request.path}")
-            return JsonResponse({'error': 'Token required'}, status=401)
-        
-        logger.debug(f"Token received: {token[:20]}...")
-        payload = decode_jwt_token(token)
-        if not payload:
-            logger.warning(f"Invalid token for {request.path}")
-            return JsonResponse({'error': 'Invalid token'}, status=401)
-        
-        try:
-            user = User.objects.get(id=payload['user_id'])
-            request.user = user
-            logger.debug(f"JWT auth successful for user: {user.username} (ID: {user.id})")
-        except User.DoesNotExist:
-            logger.error(f"User not found for token payload: {payload}")
-            return JsonResponse({'error': 'User not found'}, status=401)
+        user, error = authenticate_request(request)
+        if error:
+            return error
+        _login_user(request, user)
         
         return view_func(request, *args, **kwargs)
-    return wrapper
\ No newline at end of file
+    return wrapper
+
+def authenticate_request(request):
+    """Return (user, None) for a valid x-api-key token, (None, error response) otherwise"""
+    token, payload, error = _token_payload(request)
+    if error:
+        return None, error
+    
+    user_id = payload['user_id']
+    user = user_cache.get(user_id)
+    if user is None:
+        user = User.objects.filter(id=user_id).first()
+        if user is not None:
+            user_cache.set(user_id, user)
+    error = _user_error(token, payload, user)
+    if error:
+        return None, error
+    return user, None
\ No newline at end of file
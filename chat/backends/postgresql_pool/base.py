@@ -0,0 +1,61 @@
+"""PostgreSQL backend whose connections are checked out of chat.pool.
+
+Selected with ENGINE 'chat.backends.postgresql_pool'; the pool options are the
+'POOL' entry of the database settings. Closing the connection (end of
+request, connections.close_all()) gives it back to the pool of its alias.
+"""
+import os
+from functools import partial
+from django.db import connections
+from django.db.backends.postgresql import base
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from chat import pool as connection_pool
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Set to False before connecting for a session that must stay out of the
+    # pool, e.g. the LISTEN connection of chat.events
+    pooled = True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._pool = None
+
+    def get_new_connection(self, conn_params):
+        connect = partial(super().get_new_connection, conn_params)
+        if not self.pooled:
+            return connect()
+        pool = connection_pool.get_pool(self.alias, self.settings_dict.get('POOL', {}), connect)
+        raw = pool.getconn(connect)
+        self._pool = pool
+        return raw
+
+    def _close(self):
+        pool, self._pool = self._pool, None
+        if pool is None:
+            return super()._close()
+        if pool.pid != os.getpid():
+            # Opened by the parent process: closing it would end the parent's session
+            connection_pool.forget(self.connection)
+            return
+        raw = self.connection
+        reusable = (
+            not self.in_atomic_block
+            and raw.closed == 0
+            and raw.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        )
+        with self.wrap_database_errors:
+            pool.putconn(raw, reusable)
+
+
+def _detach_after_fork():
+    # A connection opened before the fork is shared with the parent: the
+    # child must neither query nor close it
+    for wrapper in connections.all(initialized_only=True):
+        if isinstance(wrapper, DatabaseWrapper) and wrapper.connection is not None:
+            connection_pool.forget(wrapper.connection)
+            wrapper.connection = None
+            wrapper._pool = None
+
+
+os.register_at_fork(after_in_child=_detach_after_fork)
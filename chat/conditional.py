@@ -0,0 +1,88 @@
+"""Validators for conditional GET on /messages and /users.
+
+The ETag covers everything the response depends on: the newest row the
+caller can see (one indexed lookup), the query string, the caller, and a
+generation counter bumped in the Django cache by changes that add no rows
+(deletions, renames, image variants appearing). With the default
+per-process LocMemCache each worker keeps its own counters; several workers
+should share a cache backend so those changes are seen everywhere.
+
+There is deliberately no Last-Modified: it has one-second resolution, so a
+row created in the same second as the client's copy, or a change that adds
+no row at all, would still answer If-Modified-Since with a 304.
+"""
+import hashlib
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from .media import signed_expiry
+
+FEED_GENERATION_KEY = 'chat:feed-generation'
+USERS_GENERATION_KEY = 'chat:users-generation'
+
+
+def generation(key):
+    value = cache.get(key)
+    if value is None:
+        # Start from the clock, not 0, so a counter lost to eviction or a
+        # restart cannot repeat a value clients already hold in an ETag
+        cache.add(key, time.time_ns(), None)
+        value = cache.get(key)
+    return value
+
+
+def bump_generation(*keys):
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, time.time_ns(), None)
+
+
+def make_etag(*parts):
+    return '"%s"' % hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+
+def feed_etag(request, newest):
+    """ETag of GET /messages given the newest visible row"""
+    # An older message may still be committing behind a newest one younger
+    # than FEED_SETTLE_SECONDS: never 304 until the newest one has settled
+    settling = newest and newest['created_at'] > timezone.now() - timedelta(seconds=settings.FEED_SETTLE_SECONDS)
+    return make_etag(
+        request.user.id, sorted(request.GET.items()),
+        newest and (newest['id'], newest['created_at'].isoformat()),
+        # Private image URLs are re-signed when the expiry bucket moves on
+        generation(FEED_GENERATION_KEY), signed_expiry(),
+        settling and time.time_ns(),
+    )
+
+
+def users_etag(request, newest):
+    """ETag of GET /users given the most recent user"""
+    return make_etag(
+        sorted(request.GET.items()),
+        newest and newest['id'],
+        generation(USERS_GENERATION_KEY),
+    )
+
+
+def not_modified(request, etag):
+    """304 (or 412) response if a precondition settles the request, else None"""
+    # If-Modified-Since and If-Unmodified-Since are ignored: only the ETag decides
+    response = get_conditional_response(
+        request, etag=etag, response=set_validators(HttpResponse(), etag),
+    )
+    # Without a matching precondition Django hands back the response given
+    return response if response.status_code in (304, 412) else None
+
+
+def set_validators(response, etag):
+    response['ETag'] = etag
+    # Per-user content: clients may keep it but must revalidate each time
+    response['Cache-Control'] = 'private, no-cache'
+    response['Vary'] = 'x-api-key'
+    return response
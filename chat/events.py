@@ -0,0 +1,216 @@
+import asyncio
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import deque
+from django.conf import settings
+from django.db import connection, transaction
+
+logger = logging.getLogger('chat.events')
+
+
+class Subscriber:
+    """One SSE connection: a bounded buffer of serialized messages.
+
+    The hub never blocks on a subscriber. When the buffer is full the
+    subscriber is dropped; the client reconnects with Last-Event-ID and
+    catches up from the database.
+    """
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def wants(self, row):
+        return row['to_user_id'] is None or self.user_id in (row['from_user_id'], row['to_user_id'])
+
+    def offer(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.closed = True
+            return False
+
+
+class AsyncSubscriber(Subscriber):
+    """Subscriber read by a coroutine: events are handed to its event loop,
+    so waiting for them holds no thread."""
+
+    def __init__(self, user_id, maxsize, loop):
+        super().__init__(user_id, maxsize)
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.loop = loop
+
+    def offer(self, event):
+        # Called from the listener (or committing) thread
+        if self.queue.qsize() >= self.queue.maxsize:
+            self.closed = True
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # Event loop closed
+            self.closed = True
+            return False
+        return True
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.closed = True
+
+
+class RecentIds:
+    """The last `size` ids added, to send each message once per stream"""
+
+    def __init__(self, size):
+        self.size = size
+        self._order = deque()
+        self._ids = set()
+
+    def add(self, event_id):
+        """False if `event_id` was already added"""
+        if event_id in self._ids:
+            return False
+        self._ids.add(event_id)
+        self._order.append(event_id)
+        if len(self._order) > self.size:
+            self._ids.discard(self._order.popleft())
+        return True
+
+
+class MessageHub:
+    """Per-process fan-out of new messages to SSE subscribers.
+
+    On PostgreSQL a single listener thread per process receives the
+    NOTIFY sent by publish_message(), so every gunicorn worker on every
+    node sees every message without an extra broker. Each notification is
+    fetched and serialized once per process, then offered to the
+    subscribers allowed to see it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listener = None
+
+    def subscribe(self, user_id, loop=None, limit=None):
+        """New subscriber of `user_id`; an AsyncSubscriber for the coroutines
+        of `loop`. None when `limit` subscribers are already connected."""
+        if loop is None:
+            subscriber = Subscriber(user_id, settings.SSE_BUFFER_SIZE)
+        else:
+            subscriber = AsyncSubscriber(user_id, settings.SSE_BUFFER_SIZE, loop)
+        with self._lock:
+            if limit is not None and len(self._subscribers) >= limit:
+                return None
+            self._subscribers.add(subscriber)
+            if connection.vendor == 'postgresql' and (self._listener is None or not self._listener.is_alive()):
+                self._listener = threading.Thread(target=self._listen, name='chat-events-listener', daemon=True)
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        subscriber.closed = True
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subscribers)
+
+    def dispatch(self, message_ids):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        if not subscribers or not message_ids:
+            return
+        # Imported lazily: views imports this module
+        from .views import FEED_FIELDS, _serialize_feed_row
+        from .models import Message
+
+        rows = Message.objects.filter(pk__in=message_ids).values(*FEED_FIELDS).order_by('created_at', 'id')
+        for row in rows:
+            event = (row['id'], json.dumps(_serialize_feed_row(row)))
+            for subscriber in subscribers:
+                if subscriber.closed or not subscriber.wants(row):
+                    continue
+                if not subscriber.offer(event):
+                    logger.warning("SSE buffer full for user %s, dropping connection", subscriber.user_id)
+                    self.unsubscribe(subscriber)
+
+    def _listen(self):
+        channel = settings.SSE_NOTIFY_CHANNEL
+        backoff = 1
+        # The LISTEN session lives as long as the thread: it neither takes
+        # a slot of the connection pool nor goes back to it (chat.pool)
+        connection.pooled = False
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    self._listener = None
+                    break
+            try:
+                connection.ensure_connection()
+                raw = connection.connection
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{channel}"')
+                logger.info("Listening for new messages on channel '%s'", channel)
+                backoff = 1
+                while True:
+                    with self._lock:
+                        if not self._subscribers:
+                            break
+                    if select.select([raw], [], [], settings.SSE_HEARTBEAT_SECONDS) == ([], [], []):
+                        continue
+                    raw.poll()
+                    ids = []
+                    while raw.notifies:
+                        notify = raw.notifies.pop(0)
+                        try:
+                            ids.append(int(json.loads(notify.payload)['id']))
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning("Ignoring malformed notification: %r", notify.payload)
+                    self.dispatch(ids)
+            except Exception as e:
+                logger.error("Message listener failed, reconnecting in %ss: %s", backoff, e)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                connection.close()
+
+
+hub = MessageHub()
+
+
+def publish_message(message):
+    """Announce a newly saved message to every process once it is committed"""
+    publish_messages([message])
+
+
+def publish_messages(messages):
+    """Announce newly saved messages once committed, in one statement"""
+    message_ids = [message.id for message in messages]
+
+    def notify():
+        if connection.vendor == 'postgresql':
+            payloads = [json.dumps({'id': message_id}) for message_id in message_ids]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT pg_notify(%s, payload) FROM unnest(%s::text[]) AS payload",
+                    [settings.SSE_NOTIFY_CHANNEL, payloads],
+                )
+        else:
+            # No LISTEN/NOTIFY (e.g. SQLite): only this process is notified
+            hub.dispatch(message_ids)
+
+    transaction.on_commit(notify)
+
+
+def format_event(event_id, data):
+    return f"id: {event_id}\nevent: message\ndata: {data}\n\n".encode('utf-8')
@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from django.conf import settings
+from django.db import connections
+
+from .metrics import current_request
+from .profiling import current_profile
+from .routers import current_route
+
+logger = logging.getLogger('chat.hashing')
+
+# Request state taken over by the pool threads, so that the queries of a job
+# count for the request that submitted it and follow its database routing
+# (only these variables: a full context copy could carry the request
+# thread's database connection along)
+REQUEST_VARS = (current_request, current_profile, current_route)
+
+
+class Overloaded(Exception):
+    """Raised when the hashing executor cannot take or finish work in time"""
+
+
+class HashingExecutor:
+    """Dedicated, bounded pool for password hashing (PBKDF2).
+
+    At most `concurrency` hashes run at once per process and at most
+    `queue_depth` more may wait; anything beyond that is refused right
+    away instead of piling up behind the request workers. hashlib releases
+    the GIL while hashing, so the cap really is the CPU spent on it.
+    """
+
+    def __init__(self, concurrency, queue_depth, timeout):
+        self.concurrency = concurrency
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='chat-hashing')
+        self._slots = threading.BoundedSemaphore(concurrency + queue_depth)
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def submit(self, func, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded('Hashing queue is full')
+        with self._lock:
+            self.pending += 1
+        try:
+            carried = [(var, var.get()) for var in REQUEST_VARS]
+            return self._executor.submit(self._call, carried, func, args, kwargs)
+        except Exception:
+            self._release()
+            raise
+
+    def _call(self, carried, func, args, kwargs):
+        for var, value in carried:
+            var.set(value)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            # Pool threads live outside the request cycle: never keep
+            # their database connections open.
+            connections.close_all()
+            self._release(completed=True)
+
+    def _release(self, completed=False):
+        with self._lock:
+            self.pending -= 1
+            if completed:
+                self.completed += 1
+        self._slots.release()
+
+    def run(self, func, *args, **kwargs):
+        future = self.submit(func, *args, **kwargs)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise Overloaded('Hashing timed out')
+
+    async def arun(self, func, *args, **kwargs):
+        future = asyncio.wrap_future(self.submit(func, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise Overloaded('Hashing timed out')
+
+    def stats(self):
+        with self._lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue_depth': self.queue_depth,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timeouts': self.timeouts,
+            }
+
+
+hashing = HashingExecutor(
+    settings.HASHING_CONCURRENCY,
+    settings.HASHING_QUEUE_DEPTH,
+    settings.HASHING_TIMEOUT,
+)
@@ -0,0 +1,108 @@
+"""Resized and WebP variants of message images.
+
+Rendering runs in a small process pool so Pillow's CPU time never lands on
+a request worker. The pool uses the 'spawn' start method and runs
+chat.rendering.render_variants: children import only that module and
+Pillow, not Django, so they are safe to start from a threaded gunicorn
+worker. Variant names are stored on Message.image_variants once rendering
+is done.
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connections, transaction
+from .conditional import FEED_GENERATION_KEY, bump_generation
+from .rendering import render_variants
+
+logger = logging.getLogger('chat.images')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+        return _pool
+
+
+def render_in_pool(image_name):
+    """Queue rendering for one stored image; returns a Future of {variant: name}"""
+    storage = _image_storage()
+    return get_pool().submit(render_variants, storage.path(image_name), str(settings.MEDIA_ROOT), image_name)
+
+
+def submit_variants(message_id, image_name):
+    """Queue rendering for one image; the result is saved on the message"""
+    submitter = threading.get_ident()
+    future = render_in_pool(image_name)
+    future.add_done_callback(lambda f: _store_variants(message_id, image_name, f, submitter))
+    return future
+
+
+def schedule_variants(message):
+    """Render variants of a newly saved message after its transaction commits"""
+    if not message.image or not settings.IMAGE_VARIANTS_ENABLED:
+        return
+    message_id, image_name = message.pk, message.image.name
+    transaction.on_commit(lambda: _reuse_or_submit(message_id, image_name))
+
+
+def existing_variants(image_name):
+    """Variants already rendered for a stored image, or None. With
+    content-addressed storage a re-sent image shares the first one's file."""
+    from .models import Message
+
+    return (
+        Message.objects.filter(image=image_name).exclude(image_variants={})
+        .values_list('image_variants', flat=True).first()
+    )
+
+
+def save_variants(message_ids, image_name, variants):
+    """Store rendered variants on messages that still carry image_name.
+    Callers bump FEED_GENERATION_KEY so cached feeds pick them up."""
+    from .models import Message
+
+    return Message.objects.filter(pk__in=message_ids, image=image_name).update(image_variants=variants)
+
+
+def _reuse_or_submit(message_id, image_name):
+    existing = existing_variants(image_name)
+    if existing:
+        save_variants([message_id], image_name, existing)
+        bump_generation(FEED_GENERATION_KEY)
+        return
+    try:
+        submit_variants(message_id, image_name)
+    except Exception as e:
+        # The message is already saved; backfill_image_variants can catch up
+        logger.error("Could not queue variant rendering for message %s: %s", message_id, e)
+
+
+def _store_variants(message_id, image_name, future, submitter):
+    try:
+        variants = future.result()
+        save_variants([message_id], image_name, variants)
+        bump_generation(FEED_GENERATION_KEY)
+        logger.info("Rendered %s variants for message %s", len(variants), message_id)
+    except Exception as e:
+        logger.error("Variant rendering failed for message %s (%s): %s", message_id, image_name, e)
+    finally:
+        # Done callbacks normally run on the pool's management thread, which
+        # must not keep a connection open; if the future was already done
+        # the callback ran inline and the connection belongs to the caller.
+        if threading.get_ident() != submitter:
+            connections.close_all()
+
+
+def _image_storage():
+    from .models import Message
+    return Message._meta.get_field('image').storage
@@ -0,0 +1,139 @@
+"""Structured request logging (LOG_MODE=structured).
+
+Records go through a bounded in-memory queue to a listener thread, which does
+all the formatting (the %-style message included) and the file or stream
+I/O. The request thread only appends a record to the queue; when the queue
+is full the record is dropped and counted instead of blocking the request.
+Access lines can be sampled per route and status class
+(LOG_SAMPLE_RATES), so high-volume 2xx polling does not dominate the log.
+The queue depth, dropped records and the time spent on access lines are
+exported on /metrics (chat_log_*, chat_access_log_*).
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from . import metrics
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; request fields come from `extra={'http': {...}}`"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        http = getattr(record, 'http', None)
+        if http:
+            entry.update(http)
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class QueuedHandler(QueueHandler):
+    """QueueHandler with its own listener thread writing to `filename` (or
+    stderr). The listener is started lazily in each process, so handlers
+    configured before a fork (gunicorn --preload) work in the workers."""
+
+    def __init__(self, filename=None, queue_size=10000):
+        super().__init__(queue.Queue(queue_size))
+        self.filename = filename
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._pid = None
+        self._listener = None
+        self._start_lock = threading.Lock()
+
+    def _start(self):
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # A queue inherited through fork has no listener thread behind it
+            self.queue = queue.Queue(self.queue_size)
+            target = logging.FileHandler(self.filename) if self.filename else logging.StreamHandler()
+            target.setFormatter(self.formatter)
+            self._listener = QueueListener(self.queue, target)
+            self._listener.start()
+            self._pid = os.getpid()
+            atexit.register(self._listener.stop)
+
+    def prepare(self, record):
+        # Leave formatting to the listener thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.log_records_dropped.labels(self.name).inc()
+        metrics.log_queue_records.labels(self.name).set(self.queue.qsize())
+
+    def emit(self, record):
+        if self._pid != os.getpid():
+            self._start()
+        super().emit(record)
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'capacity': self.queue_size, 'dropped': self.dropped}
+
+
+class RequestSampler:
+    """Keep rate for access lines, from a spec such as
+    'messages:2xx=0.05,users:2xx=0.1,2xx=0.5'. The most specific entry wins
+    (route:class, then class); unlisted classes are always logged."""
+
+    def __init__(self, spec):
+        self.rates = {}
+        for item in filter(None, (part.strip() for part in spec.split(','))):
+            key, _, rate = item.partition('=')
+            self.rates[key.strip()] = float(rate)
+
+    def rate(self, route, status):
+        status_class = f"{status // 100}xx"
+        return self.rates.get(f"{route}:{status_class}", self.rates.get(status_class, 1.0))
+
+    def keep(self, rate):
+        return rate >= 1.0 or random.random() < rate
+
+
+class LoggingCost:
+    """Time spent by request threads in access logging, in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.logged = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    def record(self, logged, seconds):
+        with self._lock:
+            self.requests += 1
+            self.logged += logged
+            self.seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+        metrics.access_log_seconds.observe(seconds)
+        if logged:
+            metrics.access_log_lines.inc(logged)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'logged': self.logged,
+                'mean_us': self.seconds / self.requests * 1e6 if self.requests else 0.0,
+                'max_us': self.max_seconds * 1e6,
+            }
+
+
+logging_cost = LoggingCost()
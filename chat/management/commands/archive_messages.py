@@ -0,0 +1,78 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils import timezone
+from chat.models import ArchivedMessage, Message
+
+
+class Command(BaseCommand):
+    help = (
+        "Move messages older than ARCHIVE_AFTER_DAYS from chat_message to the archive table, "
+        "one transaction per batch. Interrupted runs resume where they stopped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help="Archive messages older than this (at least ARCHIVE_AFTER_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=settings.ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--max-batches', type=int, help="Stop after this many batches")
+        parser.add_argument('--pause', type=float, default=0.0, help="Seconds to sleep between batches")
+        parser.add_argument('--dry-run', action='store_true', help="Only count the messages to archive")
+        parser.add_argument('--vacuum', action='store_true', help="VACUUM ANALYZE chat_message afterwards (PostgreSQL)")
+
+    def handle(self, *args, **options):
+        if not settings.ARCHIVE_AFTER_DAYS:
+            raise CommandError("Archiving is disabled (ARCHIVE_AFTER_DAYS=0)")
+        days = options['days'] or settings.ARCHIVE_AFTER_DAYS
+        if days < settings.ARCHIVE_AFTER_DAYS:
+            # Feed reads only look for archived messages past ARCHIVE_AFTER_DAYS
+            raise CommandError(f"--days must be at least ARCHIVE_AFTER_DAYS ({settings.ARCHIVE_AFTER_DAYS})")
+        cutoff = timezone.now() - timedelta(days=days)
+        candidates = Message.objects.filter(created_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f"{candidates.count()} messages older than {cutoff:%Y-%m-%d %H:%M} to archive")
+            return
+
+        connection = connections[Message.objects.db]
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(field.column) for field in Message._meta.concrete_fields)
+        hot_table = quote(Message._meta.db_table)
+        archive_table = quote(ArchivedMessage._meta.db_table)
+
+        last_id = 0
+        moved = batches = 0
+        started = time.monotonic()
+        while options['max_batches'] is None or batches < options['max_batches']:
+            # Keyset over id: one pass over the primary key for the whole run
+            ids = list(
+                candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:options['batch_size']]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+            placeholders = ', '.join(['%s'] * len(ids))
+            # Raw statements: the rows move as they are, without the delete
+            # signals (the image blobs stay referenced by the archived rows).
+            with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {archive_table} ({columns}, {quote('archived_at')}) "
+                    f"SELECT {columns}, %s FROM {hot_table} WHERE {quote('id')} IN ({placeholders})",
+                    [timezone.now(), *ids],
+                )
+                cursor.execute(f"DELETE FROM {hot_table} WHERE {quote('id')} IN ({placeholders})", ids)
+            moved += len(ids)
+            batches += 1
+            self.stdout.write(f"Archived {moved} messages (up to id {last_id})")
+            if options['pause']:
+                time.sleep(options['pause'])
+
+        if options['vacuum'] and moved and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(f"VACUUM (ANALYZE) {hot_table}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {moved} messages older than {cutoff:%Y-%m-%d %H:%M} "
+            f"in {batches} batches ({time.monotonic() - started:.1f}s)"
+        ))
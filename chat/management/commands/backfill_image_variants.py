@@ -0,0 +1,66 @@
+from concurrent.futures import as_completed
+from django.core.management.base import BaseCommand
+from chat.conditional import FEED_GENERATION_KEY, bump_generation
+from chat.images import existing_variants, render_in_pool, save_variants
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = "Render thumbnail/WebP variants for existing message images"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--force', action='store_true', help="Re-render images that already have variants")
+
+    def handle(self, *args, **options):
+        messages = Message.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['force']:
+            messages = messages.filter(image_variants={})
+
+        last_id = 0
+        done = reused = failed = 0
+        # image name -> variants rendered by this run, so a blob shared by
+        # messages in different batches is rendered once even with --force
+        rendered = {}
+        while True:
+            # Keyset over id so rows updated meanwhile are neither skipped nor repeated
+            batch = list(
+                messages.filter(id__gt=last_id).order_by('id').values_list('id', 'image')[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_id = batch[-1][0]
+
+            # Content-addressed storage: messages re-sending an image share its name
+            by_image = {}
+            for message_id, image_name in batch:
+                by_image.setdefault(image_name, []).append(message_id)
+
+            futures = {}
+            for image_name, message_ids in by_image.items():
+                variants = rendered.get(image_name)
+                if variants is None and not options['force']:
+                    variants = existing_variants(image_name)
+                if variants:
+                    reused += save_variants(message_ids, image_name, variants)
+                else:
+                    futures[render_in_pool(image_name)] = (image_name, message_ids)
+
+            for future in as_completed(futures):
+                image_name, message_ids = futures[future]
+                try:
+                    variants = future.result()
+                except Exception as e:
+                    failed += len(message_ids)
+                    self.stderr.write(f"Image {image_name} (messages {message_ids}): {e}")
+                    continue
+                rendered[image_name] = variants
+                done += save_variants(message_ids, image_name, variants)
+
+            # Once per batch: cached feeds must not keep serving the old rows
+            bump_generation(FEED_GENERATION_KEY)
+            self.stdout.write(f"Processed {done + reused + failed} images ({reused} reused, {failed} failed)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered variants for {done} images, reused {reused}, {failed} failed"
+        ))
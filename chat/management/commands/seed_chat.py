@@ -0,0 +1,115 @@
+import io
+import random
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from chat.rendering import render_variants
+from chat.models import Message, upload_to
+from chat.storage import retain_blob
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Seed the database with synthetic users and messages (benchmarks, EXPLAIN plans)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--public', type=int, default=10000, help="Number of public messages")
+        parser.add_argument('--private', type=int, default=10000, help="Number of private messages")
+        parser.add_argument('--password', default='seed-password', help="Password shared by all seeded users")
+        parser.add_argument('--prefix', default='seed_user_', help="Username prefix of seeded users")
+        parser.add_argument('--span-days', type=int, default=90, help="Spread message timestamps over this many days")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=0, help="Random seed for reproducible datasets")
+        parser.add_argument('--images', type=float, default=0.0, help="Share of messages with an image (0-1)")
+        parser.add_argument('--image-variety', type=int, default=20, help="Distinct images shared by those messages")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+
+        # Hash once: PBKDF2 per seeded user would dominate the run time
+        password = make_password(options['password'])
+        prefix = options['prefix']
+        existing = set(User.objects.filter(username__startswith=prefix).values_list('username', flat=True))
+        new_users = [
+            User(username=f"{prefix}{i}", password=password)
+            for i in range(options['users'])
+            if f"{prefix}{i}" not in existing
+        ]
+        User.objects.bulk_create(new_users, batch_size=batch_size)
+        user_ids = list(User.objects.filter(username__startswith=prefix).values_list('id', flat=True))
+        self.stdout.write(f"Users: {len(new_users)} created, {len(user_ids)} available")
+        if not user_ids:
+            return
+
+        images = self._seed_images(rng, options['image_variety']) if options['images'] > 0 else {}
+        image_names = sorted(images)
+        image_refs = Counter()
+
+        total = options['public'] + options['private']
+        kinds = [False] * options['public'] + [True] * options['private']
+        rng.shuffle(kinds)
+        now = timezone.now()
+        step = timedelta(days=options['span_days']) / max(total, 1)
+
+        created = 0
+        for start in range(0, total, batch_size):
+            batch = []
+            for offset, private in enumerate(kinds[start:start + batch_size]):
+                from_id = rng.choice(user_ids)
+                image = rng.choice(image_names) if image_names and rng.random() < options['images'] else ''
+                image_refs[image] += bool(image)
+                message = Message(
+                    content=f"Seed message {start + offset}",
+                    from_user_id=from_id,
+                    to_user_id=rng.choice(user_ids) if private else None,
+                    image=image,
+                    image_variants=images.get(image, {}),
+                )
+                message.assign_conversation()
+                batch.append(message)
+            with transaction.atomic():
+                batch = Message.objects.bulk_create(batch)
+                # created_at is auto_now_add, so spread the timestamps afterwards,
+                # oldest first, to get a realistic time distribution.
+                for offset, message in enumerate(batch):
+                    message.created_at = now - step * (total - start - offset)
+                Message.objects.bulk_update(batch, ['created_at'], batch_size=1000)
+            created += len(batch)
+            self.stdout.write(f"Messages: {created}/{total}")
+
+        # bulk_create skips the post_save signal that counts image references
+        for name, count in image_refs.items():
+            if count:
+                retain_blob(name, count)
+
+        self.stdout.write(self.style.SUCCESS(f"Seeded {created} messages for {len(user_ids)} users"))
+
+    def _seed_images(self, rng, count):
+        """Store `count` distinct JPEGs with their variants; {name: variants}"""
+        from PIL import Image, ImageDraw
+
+        storage = Message._meta.get_field('image').storage
+        images = {}
+        for i in range(count):
+            # Random rectangles from the seeded generator: same files every run
+            image = Image.new('RGB', (1280, 960), tuple(rng.randrange(256) for _ in range(3)))
+            draw = ImageDraw.Draw(image)
+            for _ in range(60):
+                x, y = rng.randrange(1280), rng.randrange(960)
+                box = (x, y, x + rng.randrange(40, 400), y + rng.randrange(40, 300))
+                draw.rectangle(box, fill=tuple(rng.randrange(256) for _ in range(3)))
+            data = io.BytesIO()
+            image.save(data, 'JPEG', quality=85)
+            name = storage.save(upload_to(None, f"seed_{i}.jpg"), ContentFile(data.getvalue()))
+            images[name] = render_variants(storage.path(name), str(settings.MEDIA_ROOT), name)
+        self.stdout.write(f"Images: {len(images)} stored")
+        return images
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from chat.profiling import profile_store
+
+
+class Command(BaseCommand):
+    help = "List stored request profiles, or show one (SQL, plans and cProfile output)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('profile_id', nargs='?', help="Profile to show (X-Profile-Id); omitted: list the newest")
+        parser.add_argument('--limit', type=int, default=20, help="Profiles listed")
+
+    def handle(self, *args, **options):
+        if not options['profile_id']:
+            for profile_id in profile_store.recent()[:options['limit']]:
+                try:
+                    report = profile_store.load(profile_id)
+                except FileNotFoundError:
+                    continue
+                self.stdout.write(
+                    f"{profile_id}  {report['method']} {report['path']} -> {report['status']}  "
+                    f"{report['duration_ms']:.1f} ms, {report['query_count']} queries ({report['db_ms']:.1f} ms)"
+                )
+            return
+
+        try:
+            report = profile_store.load(options['profile_id'])
+        except FileNotFoundError:
+            raise CommandError(f"Profile {options['profile_id']} not found")
+
+        self.stdout.write(
+            f"{report['method']} {report['path']} -> {report['status']} (route {report['route']}, user {report['user_id']})"
+        )
+        self.stdout.write(
+            f"{report['duration_ms']:.1f} ms, {report['query_count']} queries in {report['db_ms']:.1f} ms\n"
+        )
+        for index, query in enumerate(report['queries'], 1):
+            self.stdout.write(f"#{index} {query['duration_ms']:.2f} ms  {query['sql']}")
+            self.stdout.write(f"    params: {query['params']}")
+            for line in query['plan'] or []:
+                self.stdout.write(f"    | {line}")
+        if report['profile']:
+            self.stdout.write('')
+            self.stdout.write(report['profile'])
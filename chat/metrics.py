@@ -0,0 +1,174 @@
+"""Prometheus metrics for the API (served on GET /metrics).
+
+Under gunicorn every worker writes its samples to PROMETHEUS_MULTIPROC_DIR
+and /metrics aggregates the files of all workers, so a scrape sees the whole
+server whichever worker answers it (gunicorn.conf.py clears the directory at
+startup and drops the files of exited workers). Without that variable the
+metrics are those of the current process.
+
+Database queries are attributed to the request running in the current
+context by an execute wrapper installed on every connection, so queries run
+by sync_to_async in the async views and while a streaming response is being
+consumed are counted too.
+"""
+import os
+import time
+from contextvars import ContextVar
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# manage.py commands run with the same environment, before gunicorn creates it
+if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+    os.makedirs(os.environ['PROMETHEUS_MULTIPROC_DIR'], exist_ok=True)
+
+request_duration = Histogram(
+    'chat_http_request_duration_seconds', 'Request latency, until the last byte of streamed responses',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS,
+)
+response_size = Histogram(
+    'chat_http_response_size_bytes', 'Response body size', ['route'], buckets=SIZE_BUCKETS,
+)
+db_queries = Histogram(
+    'chat_db_queries_per_request', 'Database queries run by one request', ['route'], buckets=QUERY_BUCKETS,
+)
+db_time = Histogram(
+    'chat_db_time_seconds', 'Time spent in database queries by one request', ['route'], buckets=LATENCY_BUCKETS,
+)
+in_flight = Gauge(
+    'chat_http_requests_in_flight', 'Requests being processed', multiprocess_mode='livesum',
+)
+
+# Connection pools (chat.pool), per database alias
+db_pool_connections = Gauge(
+    'chat_db_pool_connections', 'Pooled database connections by state (idle, in_use)', ['alias', 'state'],
+    multiprocess_mode='livesum',
+)
+db_pool_max_size = Gauge(
+    'chat_db_pool_max_size', 'Connections the pools may open', ['alias'], multiprocess_mode='livesum',
+)
+db_pool_waiting = Gauge(
+    'chat_db_pool_waiting', 'Checkouts waiting for a connection to be given back', ['alias'],
+    multiprocess_mode='livesum',
+)
+db_pool_wait = Histogram(
+    'chat_db_pool_wait_seconds', 'Time a checkout waited for a free pool slot', ['alias'],
+    buckets=(0.001,) + LATENCY_BUCKETS,
+)
+db_pool_events = Counter(
+    'chat_db_pool_events_total',
+    'Connections opened and closed (recycled, idle, broken, ping_failed) by the pools, and checkout timeouts',
+    ['alias', 'event'],
+)
+
+# Public timeline buffer (chat.timeline); hit rate = hit / (hit + miss)
+timeline_lookups = Counter(
+    'chat_timeline_lookups_total', 'Feed pages looked up in the public timeline buffer (hit, miss)', ['result'],
+)
+timeline_refills = Counter(
+    'chat_timeline_refills_total', 'Public timeline buffer refills (catch_up, reload)', ['kind'],
+)
+timeline_evictions = Counter(
+    'chat_timeline_evictions_total', 'Rows evicted from the public timeline buffer',
+)
+timeline_rows = Gauge(
+    'chat_timeline_rows', 'Rows held by the public timeline buffers', multiprocess_mode='livesum',
+)
+timeline_bytes = Gauge(
+    'chat_timeline_bytes', 'Serialized bytes held by the public timeline buffers', multiprocess_mode='livesum',
+)
+
+# Authentication (chat.authentication): per-process user cache and tokens
+# refused without verification
+auth_user_cache_lookups = Counter(
+    'chat_auth_user_cache_lookups_total', 'Token users looked up in the user cache (hit, miss)', ['result'],
+)
+auth_user_cache_evictions = Counter(
+    'chat_auth_user_cache_evictions_total', 'Users evicted from the user cache to stay within its size',
+)
+auth_user_cache_size = Gauge(
+    'chat_auth_user_cache_size', 'Users held by the user caches', multiprocess_mode='livesum',
+)
+auth_rejected_short_circuits = Counter(
+    'chat_auth_rejected_short_circuits_total',
+    'Requests refused on a token that kept failing, without verifying it again',
+)
+
+# Structured logging (chat.log, LOG_MODE=structured)
+log_records_dropped = Counter(
+    'chat_log_records_dropped_total', 'Log records dropped because the log queue was full', ['handler'],
+)
+log_queue_records = Gauge(
+    'chat_log_queue_records', 'Log records waiting for the writer thread', ['handler'], multiprocess_mode='livesum',
+)
+access_log_seconds = Histogram(
+    'chat_access_log_seconds', 'Time a request thread spent on its access line (sampling included)',
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+access_log_lines = Counter(
+    'chat_access_log_lines_total', 'Access lines written (kept by LOG_SAMPLE_RATES)',
+)
+
+
+class RequestMetrics:
+    __slots__ = ('start', 'queries', 'db_seconds', 'size')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.size = 0
+
+
+current_request = ContextVar('chat_request_metrics', default=None)
+
+
+def count_queries(execute, sql, params, many, context):
+    metrics = current_request.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - start
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # Connected in ChatConfig.ready(), before any connection is opened
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+
+def request_started():
+    metrics = RequestMetrics()
+    in_flight.inc()
+    # Left set after the response: the next request in this context replaces it
+    current_request.set(metrics)
+    return metrics
+
+
+def request_finished(request, response, metrics):
+    route = request.resolver_match.url_name if request.resolver_match else 'unmatched'
+    request_duration.labels(route, request.method, str(response.status_code)).observe(
+        time.perf_counter() - metrics.start
+    )
+    response_size.labels(route).observe(metrics.size)
+    db_queries.labels(route).observe(metrics.queries)
+    db_time.labels(route).observe(metrics.db_seconds)
+    in_flight.dec()
+
+
+def render():
+    """Exposition text and content type for the /metrics view"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
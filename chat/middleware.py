@@ -1,69 +1,256 @@
 import logging
+import random
 import time
-import json
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from django.utils.deprecation import MiddlewareMixin
+from .log import RequestSampler, logging_cost
+from .metrics import request_finished, request_started
+from .authentication import decode_jwt_token
+from .profiling import RequestProfile, current_profile, finish_profile
+from .routers import Route, current_route, is_pinned, pin_to_primary, replicas
 
 logger = logging.getLogger('api_requests')
 
 class RequestLoggingMiddleware(MiddlewareMixin):
+    """Access logging.
+
+    LOG_MODE=text: human-readable lines (method/path, origin, user agent,
+    status and duration). LOG_MODE=structured: one JSON line per request,
+    sampled per route and status class (LOG_SAMPLE_RATES); errors, slow
+    requests and exceptions are always logged.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.structured = settings.LOG_MODE == 'structured'
+        self.sampler = RequestSampler(settings.LOG_SAMPLE_RATES)
+
     def process_request(self, request):
-        request.start_time = time.time()
-        
+        request.start_time = time.perf_counter()
+        if self.structured:
+            return None
+
         # Log basic request info
-        logger.info(f"📥 {request.method} {request.path}")
-        logger.info(f"   Origin: {request.META.get('HTTP_ORIGIN', 'N/A')}")
-        logger.info(f"   User-Agent: {request.META.get('HTTP_USER_AGENT', 'N/A')[:100]}")
-        logger.info(f"   Content-Type: {request.META.get('CONTENT_TYPE', 'N/A')}")
-        
-        # Log headers (excluding sensitive ones)
-        sensitive_headers = ['authorization', 'x-api-key', 'cookie']
-        headers = {}
-        for key, value in request.META.items():
-            if key.startswith('HTTP_') and not any(sensitive in key.lower() for sensitive in sensitive_headers):
-                header_name = key[5:].replace('_', '-').title()
-                headers[header_name] = value
-        
-        if headers:
-            logger.debug(f"   Headers: {headers}")
-        
-        # Log authentication info if present
-        if 'HTTP_X_API_KEY' in request.META:
-            token = request.META['HTTP_X_API_KEY']
-            logger.debug(f"   Auth Token: {token[:10]}...")
-        
+        logger.info("📥 %s %s", request.method, request.path)
+        logger.info("   Origin: %s", request.META.get('HTTP_ORIGIN', 'N/A'))
+        logger.info("   User-Agent: %.100s", request.META.get('HTTP_USER_AGENT', 'N/A'))
+        logger.info("   Content-Type: %s", request.META.get('CONTENT_TYPE', 'N/A'))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            # Log headers (excluding sensitive ones)
+            sensitive_headers = ['authorization', 'x-api-key', 'cookie']
+            headers = {}
+            for key, value in request.META.items():
+                if key.startswith('HTTP_') and not any(sensitive in key.lower() for sensitive in sensitive_headers):
+                    header_name = key[5:].replace('_', '-').title()
+                    headers[header_name] = value
+
+            if headers:
+                logger.debug("   Headers: %s", headers)
+
+            # Log authentication info if present
+            if 'HTTP_X_API_KEY' in request.META:
+                logger.debug("   Auth Token: %.10s...", request.META['HTTP_X_API_KEY'])
+
         return None
-    
+
     def process_response(self, request, response):
-        if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            
-            status_emoji = "✅" if 200 <= response.status_code < 300 else "❌"
-            logger.info(f"📤 {status_emoji} {request.method} {request.path} - {response.status_code} ({duration:.3f}s)")
-            
-            # Log response details for errors
-            if response.status_code >= 400:
-                try:
-                    if hasattr(response, 'content') and response.content:
-                        content = response.content.decode('utf-8')
-                        if content.startswith('{'):  # JSON response
-                            response_data = json.loads(content)
-                            logger.warning(f"   Error Response: {response_data}")
-                        else:
-                            logger.warning(f"   Error Response: {content[:200]}")
-                except:
-                    logger.warning(f"   Error Response: Could not parse response content")
-            
-            # Log slow requests
-            if duration > 1.0:
-                logger.warning(f"🐌 Slow request: {request.method} {request.path} took {duration:.3f}s")
-        
+        if not hasattr(request, 'start_time'):
+            return response
+        duration = time.perf_counter() - request.start_time
+
+        if self.structured:
+            started = time.perf_counter()
+            logged = self._log_structured(request, response, duration)
+            logging_cost.record(logged, time.perf_counter() - started)
+            return response
+
+        status_emoji = "✅" if 200 <= response.status_code < 300 else "❌"
+        logger.info("📤 %s %s %s - %s (%.3fs)", status_emoji, request.method, request.path, response.status_code, duration)
+
+        # Log response details for errors
+        if response.status_code >= 400 and not response.streaming and response.content:
+            logger.warning("   Error Response: %s", response.content[:200].decode('utf-8', 'replace'))
+
+        # Log slow requests
+        if duration > settings.LOG_SLOW_SECONDS:
+            logger.warning("🐌 Slow request: %s %s took %.3fs", request.method, request.path, duration)
+
         return response
-    
+
+    def _log_structured(self, request, response, duration):
+        status = response.status_code
+        route = request.resolver_match.url_name if request.resolver_match else None
+        slow = duration > settings.LOG_SLOW_SECONDS
+        rate = 1.0 if slow else self.sampler.rate(route, status)
+        if not self.sampler.keep(rate):
+            return False
+
+        http = {
+            'method': request.method,
+            'path': request.path,
+            'route': route,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'sample_rate': rate,
+        }
+        # Set by jwt_required; request.user itself may be a lazy session lookup
+        user = request.__dict__.get('_force_auth_user')
+        if user is not None:
+            http['user_id'] = user.pk
+        request_id = request.META.get('HTTP_X_REQUEST_ID')
+        if request_id:
+            http['request_id'] = request_id
+        if not response.streaming:
+            http['bytes'] = len(response.content)
+            if status >= 400:
+                http['error'] = response.content[:200].decode('utf-8', 'replace')
+
+        level = logging.WARNING if status >= 500 or slow else logging.INFO
+        logger.log(level, "%s %s %s", request.method, request.path, status, extra={'http': http})
+        return True
+
     def process_exception(self, request, exception):
         if hasattr(request, 'start_time'):
-            duration = time.time() - request.start_time
-            logger.error(f"💥 Exception in {request.method} {request.path} after {duration:.3f}s: {exception}")
+            duration = time.perf_counter() - request.start_time
+            logger.error("💥 Exception in %s %s after %.3fs: %s", request.method, request.path, duration, exception)
         else:
-            logger.error(f"💥 Exception in {request.method} {request.path}: {exception}")
+            logger.error("💥 Exception in %s %s: %s", request.method, request.path, exception)
         
-        return None
\ No newline at end of file
+        return None
+
+
+class MetricsMiddleware(MiddlewareMixin):
+    """Request metrics for /metrics (chat.metrics). Streaming responses are
+    recorded when the stream ends, so the feed's database reads and the
+    full body size are included."""
+
+    def process_request(self, request):
+        request._metrics = request_started()
+        return None
+
+    def process_response(self, request, response):
+        metrics = getattr(request, '_metrics', None)
+        if metrics is None:
+            return response
+        if not response.streaming:
+            metrics.size = len(response.content)
+            request_finished(request, response, metrics)
+        elif response.is_async:
+            response.streaming_content = self._observe_async(request, response, metrics, response.streaming_content)
+        else:
+            response.streaming_content = self._observe(request, response, metrics, response.streaming_content)
+        return response
+
+    def _observe(self, request, response, metrics, content):
+        try:
+            for chunk in content:
+                metrics.size += len(chunk)
+                yield chunk
+        finally:
+            request_finished(request, response, metrics)
+
+    async def _observe_async(self, request, response, metrics, content):
+        try:
+            async for chunk in content:
+                metrics.size += len(chunk)
+                yield chunk
+        finally:
+            request_finished(request, response, metrics)
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    """Profile requests on demand (chat.profiling) and give every request
+    the context used to report slow queries.
+
+    Requests sent with the admin X-Profile-Token get X-Profile-Id (the
+    stored report) and, unless streamed, a Server-Timing header back.
+    Sampled requests are stored without telling the client.
+    """
+
+    def process_request(self, request):
+        token = request.META.get('HTTP_X_PROFILE_TOKEN')
+        request._profile_requested = bool(
+            token and settings.PROFILE_TOKEN and constant_time_compare(token, settings.PROFILE_TOKEN)
+        )
+        profiled = request._profile_requested or (
+            settings.PROFILE_SAMPLE_RATE > 0 and random.random() < settings.PROFILE_SAMPLE_RATE
+        )
+        request._profile = RequestProfile(request, profiled)
+        current_profile.set(request._profile)
+        return None
+
+    def process_response(self, request, response):
+        profile = getattr(request, '_profile', None)
+        if profile is None:
+            return response
+        if request._profile_requested:
+            response['X-Profile-Id'] = profile.id
+        if not response.streaming:
+            duration = finish_profile(profile, response)
+            if request._profile_requested:
+                response['Server-Timing'] = (
+                    f'app;dur={duration * 1000:.1f}, '
+                    f'db;dur={profile.db_seconds() * 1000:.1f};desc="{len(profile.queries)} queries"'
+                )
+        elif profile.id is not None:
+            # Stored once the body is sent: the feed reads rows while streaming
+            if response.is_async:
+                response.streaming_content = self._finish_async(profile, response, response.streaming_content)
+            else:
+                response.streaming_content = self._finish(profile, response, response.streaming_content)
+        return response
+
+    def _finish(self, profile, response, content):
+        try:
+            yield from content
+        finally:
+            finish_profile(profile, response)
+
+    async def _finish_async(self, profile, response, content):
+        try:
+            async for chunk in content:
+                yield chunk
+        finally:
+            finish_profile(profile, response)
+
+
+class ReplicaRoutingMiddleware(MiddlewareMixin):
+    """Route read-only requests to a replica (chat.routers) unless their
+    user wrote recently; pin the users a request wrote for."""
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        if replicas.aliases and not settings.SHARED_CACHE:
+            logger.warning(
+                "Read replicas without a shared cache (REDIS_URL): a user's reads only stay on the "
+                "primary after a write in the worker that handled it"
+            )
+
+    def process_request(self, request):
+        if not replicas.aliases:
+            return None
+        replica = request.method in self.SAFE_METHODS
+        if replica:
+            # Only the signature is checked here; jwt_required still
+            # authenticates the request
+            token = request.META.get('HTTP_X_API_KEY')
+            payload = decode_jwt_token(token) if token else None
+            replica = not (payload and is_pinned(payload.get('user_id')))
+        request._route = Route(replica)
+        current_route.set(request._route)
+        return None
+
+    def process_response(self, request, response):
+        route = getattr(request, '_route', None)
+        if route is not None and route.wrote:
+            user_ids = {user.pk for user in route.users if user.pk is not None}
+            # Set by jwt_required; request.user itself may be a lazy session lookup
+            user = request.__dict__.get('_force_auth_user')
+            if user is not None:
+                user_ids.add(user.pk)
+            pin_to_primary(user_ids)
+        return response
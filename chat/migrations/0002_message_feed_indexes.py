@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+from chat.operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(condition=models.Q(('to_user__isnull', True)), fields=['created_at', 'id'], name='message_public_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['from_user', 'created_at', 'id'], name='message_from_created_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(fields=['to_user', 'created_at', 'id'], name='message_to_created_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7
+
+import chat.models
+import chat.storage
+from django.db import migrations, models
+
+
+def count_existing_images(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    ImageBlob = apps.get_model('chat', 'ImageBlob')
+    counts = (
+        Message.objects.exclude(image='').exclude(image__isnull=True)
+        .values('image').annotate(refcount=models.Count('id'))
+    )
+    ImageBlob.objects.bulk_create(
+        (ImageBlob(name=row['image'], refcount=row['refcount']) for row in counts.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=chat.storage.image_storage, upload_to=chat.models.upload_to),
+        ),
+        migrations.RunPython(count_existing_images, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations
+
+TRIGRAM_INDEX = 'chat_user_username_trgm_idx'
+PREFIX_INDEX = 'chat_user_username_upper_like_idx'
+
+
+def create_username_search_index(apps, schema_editor):
+    # GET /users?q= filters on UPPER(username) LIKE '%...%' (icontains) or
+    # '...%' (istartswith); a pg_trgm GIN index on that expression serves both.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    table = schema_editor.quote_name(apps.get_model('chat', 'User')._meta.db_table)
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    if has_trigram:
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX} ON {table} '
+            f'USING gin (UPPER("username"::text) gin_trgm_ops)'
+        )
+    else:
+        # Without the contrib package only prefix searches can use an index
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {PREFIX_INDEX} ON {table} '
+            f'(UPPER("username"::text) text_pattern_ops)'
+        )
+
+
+def drop_username_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {TRIGRAM_INDEX}')
+    schema_editor.execute(f'DROP INDEX IF EXISTS {PREFIX_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_image_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_username_search_index, drop_username_search_index),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations, models
+from django.db.models.functions import Greatest, Least
+from chat.operations import AddIndexConcurrently
+
+BATCH_SIZE = 10000
+
+
+def backfill_conversations(apps, schema_editor):
+    """Fill conv_low/conv_high of existing private messages, by ranges of ids
+    so each UPDATE stays short (the migration is not atomic)"""
+    Message = apps.get_model('chat', 'Message')
+    private = Message.objects.using(schema_editor.connection.alias).filter(to_user__isnull=False)
+    last_id = private.aggregate(last=models.Max('id'))['last'] or 0
+    for start in range(0, last_id, BATCH_SIZE):
+        private.filter(id__gt=start, id__lte=start + BATCH_SIZE).update(
+            conv_low=Least('from_user_id', 'to_user_id'),
+            conv_high=Greatest('from_user_id', 'to_user_id'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    # One transaction per backfill batch instead of one for the whole table
+    atomic = False
+
+    dependencies = [
+        ('chat', '0005_user_username_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='conv_low',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='conv_high',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+        # Built after the backfill: one index build instead of per-row
+        # maintenance, concurrently so inserts go on during the build
+        AddIndexConcurrently(
+            model_name='message',
+            index=models.Index(
+                condition=models.Q(conv_low__isnull=False),
+                fields=['conv_low', 'conv_high', 'created_at', 'id'],
+                name='message_conversation_idx',
+            ),
+        ),
+    ]
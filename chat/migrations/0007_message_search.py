@@ -0,0 +1,98 @@
+# Generated by Django 4.2.7
+
+from django.db import migrations
+
+SEARCH_INDEX = 'chat_message_search_idx'
+SEARCH_FUNCTION = 'chat_message_search_vector'
+SEARCH_TRIGGER = 'chat_message_search_vector_update'
+FTS_TABLE = 'chat_message_fts'
+FTS_TRIGGERS = ('chat_message_fts_insert', 'chat_message_fts_delete', 'chat_message_fts_update')
+BATCH_SIZE = 10000
+
+
+def create_search_index(apps, schema_editor):
+    # Kept out of the model state, like the username trigram index: Django
+    # never reads these, only chat.search does. Note that a later AlterField
+    # on Message.content must check them (SQLite table rebuilds drop the
+    # triggers).
+    vendor = schema_editor.connection.vendor
+    db_table = apps.get_model('chat', 'Message')._meta.db_table
+    table = schema_editor.quote_name(db_table)
+    if vendor == 'postgresql':
+        # A nullable column without default is added without rewriting the
+        # table (a GENERATED ... STORED one would rewrite it under an ACCESS
+        # EXCLUSIVE lock); a trigger maintains it from then on, the existing
+        # rows are filled by ranges of ids, then indexed without blocking
+        # writes.
+        schema_editor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector")
+        schema_editor.execute(
+            f"CREATE OR REPLACE FUNCTION {SEARCH_FUNCTION}() RETURNS trigger LANGUAGE plpgsql AS $$ "
+            f"BEGIN NEW.search_vector := to_tsvector('simple'::regconfig, NEW.content); RETURN NEW; END $$"
+        )
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {SEARCH_TRIGGER} ON {table}")
+        schema_editor.execute(
+            f"CREATE TRIGGER {SEARCH_TRIGGER} BEFORE INSERT OR UPDATE OF content ON {table} "
+            f"FOR EACH ROW EXECUTE FUNCTION {SEARCH_FUNCTION}()"
+        )
+        with schema_editor.connection.cursor() as cursor:
+            cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+            last_id = cursor.fetchone()[0]
+        for start in range(0, last_id, BATCH_SIZE):
+            schema_editor.execute(
+                f"UPDATE {table} SET search_vector = to_tsvector('simple'::regconfig, content) "
+                f"WHERE id > %s AND id <= %s AND search_vector IS NULL",
+                [start, start + BATCH_SIZE],
+            )
+        schema_editor.execute(
+            f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {SEARCH_INDEX} ON {table} USING gin (search_vector)'
+        )
+    elif vendor == 'sqlite':
+        # External-content FTS5 table: the index only, rowid = message id
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            f"content, content='{db_table}', content_rowid='id', tokenize='unicode61 remove_diacritics 0')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS chat_message_fts_insert AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS chat_message_fts_delete AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS chat_message_fts_update AFTER UPDATE OF content ON {table} BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+            f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+        )
+        # Index the messages that already exist
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    table = schema_editor.quote_name(apps.get_model('chat', 'Message')._meta.db_table)
+    if vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SEARCH_INDEX}')
+        schema_editor.execute(f'DROP TRIGGER IF EXISTS {SEARCH_TRIGGER} ON {table}')
+        schema_editor.execute(f'DROP FUNCTION IF EXISTS {SEARCH_FUNCTION}()')
+        schema_editor.execute(f'ALTER TABLE {table} DROP COLUMN IF EXISTS search_vector')
+    elif vendor == 'sqlite':
+        for trigger in FTS_TRIGGERS:
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    # One transaction per backfill batch, and CREATE INDEX CONCURRENTLY
+    # cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('chat', '0006_message_conversation'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
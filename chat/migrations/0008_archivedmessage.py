@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7
+
+import chat.models
+import chat.storage
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('content', models.TextField()),
+                ('image', models.ImageField(blank=True, null=True, storage=chat.storage.image_storage, upload_to=chat.models.upload_to)),
+                ('image_variants', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField()),
+                ('conv_low', models.BigIntegerField(blank=True, editable=False, null=True)),
+                ('conv_high', models.BigIntegerField(blank=True, editable=False, null=True)),
+                ('archived_at', models.DateTimeField()),
+                ('from_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_sent_messages', to=settings.AUTH_USER_MODEL)),
+                ('to_user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='archived_received_messages', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(condition=models.Q(('to_user__isnull', True)), fields=['created_at', 'id'], name='archived_public_created_idx'), models.Index(fields=['from_user', 'created_at', 'id'], name='archived_from_created_idx'), models.Index(fields=['to_user', 'created_at', 'id'], name='archived_to_created_idx'), models.Index(condition=models.Q(('conv_low__isnull', False)), fields=['conv_low', 'conv_high', 'created_at', 'id'], name='archived_conversation_idx')],
+            },
+        ),
+    ]
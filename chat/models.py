@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
 import os
 import uuid
+from .storage import image_storage
 
 class User(AbstractUser):
     pass
@@ -15,8 +16,90 @@ class Message(models.Model):
     content = models.TextField()
     from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sent_messages')
     to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='received_messages', null=True, blank=True)
-    image = models.ImageField(upload_to=upload_to, null=True, blank=True)
+    image = models.ImageField(upload_to=upload_to, storage=image_storage, null=True, blank=True)
+    # Resized/WebP renditions of `image`: {variant: storage name}, see chat.images
+    image_variants = models.JSONField(default=dict, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Conversation key of a private message: the two participants' ids,
+    # lower first, whoever sent it (null for public messages)
+    conv_low = models.BigIntegerField(null=True, blank=True, editable=False)
+    conv_high = models.BigIntegerField(null=True, blank=True, editable=False)
     
     class Meta:
-        ordering = ['-created_at']
\ No newline at end of file
+        ordering = ['-created_at']
+        indexes = [
+            # One index per branch of the visible-messages query, each able to
+            # serve ORDER BY created_at DESC, id DESC with a backward scan.
+            models.Index(
+                fields=['created_at', 'id'],
+                name='message_public_created_idx',
+                condition=models.Q(to_user__isnull=True),
+            ),
+            models.Index(fields=['from_user', 'created_at', 'id'], name='message_from_created_idx'),
+            models.Index(fields=['to_user', 'created_at', 'id'], name='message_to_created_idx'),
+            # GET /messages?with=: a whole thread is one range of this index
+            models.Index(
+                fields=['conv_low', 'conv_high', 'created_at', 'id'],
+                name='message_conversation_idx',
+                condition=models.Q(conv_low__isnull=False),
+            ),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.assign_conversation()
+        # The image file is stored and its reference counted (post_save) in
+        # one transaction, see chat.storage
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def assign_conversation(self):
+        """Set conv_low/conv_high from the participants; bulk_create() does
+        not call save(), so callers inserting in bulk call this themselves."""
+        if self.to_user_id is None:
+            self.conv_low = self.conv_high = None
+        else:
+            self.conv_low, self.conv_high = sorted((self.from_user_id, self.to_user_id))
+
+
+class ArchivedMessage(models.Model):
+    """Message moved out of chat_message by `manage.py archive_messages`
+    once older than ARCHIVE_AFTER_DAYS. Same columns and id as the original,
+    so the feed reads both tables with the same queries past that age."""
+    id = models.BigIntegerField(primary_key=True)
+    content = models.TextField()
+    from_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_sent_messages')
+    to_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_received_messages', null=True, blank=True)
+    image = models.ImageField(upload_to=upload_to, storage=image_storage, null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    conv_low = models.BigIntegerField(null=True, blank=True, editable=False)
+    conv_high = models.BigIntegerField(null=True, blank=True, editable=False)
+    archived_at = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-created_at']
+        # The feed indexes of Message, for the same queries
+        indexes = [
+            models.Index(
+                fields=['created_at', 'id'],
+                name='archived_public_created_idx',
+                condition=models.Q(to_user__isnull=True),
+            ),
+            models.Index(fields=['from_user', 'created_at', 'id'], name='archived_from_created_idx'),
+            models.Index(fields=['to_user', 'created_at', 'id'], name='archived_to_created_idx'),
+            models.Index(
+                fields=['conv_low', 'conv_high', 'created_at', 'id'],
+                name='archived_conversation_idx',
+                condition=models.Q(conv_low__isnull=False),
+            ),
+        ]
+
+
+class ImageBlob(models.Model):
+    """Reference count of a stored image file, shared by duplicate uploads"""
+    name = models.CharField(max_length=100, primary_key=True)
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
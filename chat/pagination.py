@@ -0,0 +1,67 @@
+import base64
+from django.conf import settings
+from django.db import models
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_token(value):
+    """Encode a string as an opaque, URL-safe token"""
+    return base64.urlsafe_b64encode(value.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_token(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return base64.b64decode(padded.encode('ascii'), altchars=b'-_', validate=True).decode('utf-8')
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(token)
+
+
+def encode_cursor(created_at, pk):
+    """Encode a (created_at, id) position as an opaque, URL-safe token"""
+    return encode_token(f"{created_at.isoformat()}|{pk}")
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor into (created_at, id)"""
+    raw = decode_token(token)
+    try:
+        timestamp, pk = raw.rsplit('|', 1)
+        created_at = parse_datetime(timestamp)
+        pk = int(pk)
+    except (ValueError, UnicodeError):
+        raise InvalidCursor(token)
+    if created_at is None:
+        raise InvalidCursor(token)
+    return created_at, pk
+
+
+def parse_limit(value, default=None, maximum=None):
+    default = default or settings.MESSAGES_PAGE_SIZE
+    maximum = maximum or settings.MESSAGES_PAGE_MAX
+    if value in (None, ''):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid limit: {value}")
+    if limit < 1:
+        raise ValueError(f"Invalid limit: {value}")
+    return min(limit, maximum)
+
+
+def keyset_filter(queryset, position, direction):
+    """Restrict a queryset ordered by (created_at, id) to rows strictly
+    older ('before') or newer ('since') than the given position."""
+    created_at, pk = position
+    # The redundant inclusive bound on created_at is what lets the database
+    # turn the comparison into an index range condition instead of a filter.
+    if direction == 'before':
+        condition = models.Q(created_at__lt=created_at) | models.Q(id__lt=pk)
+        return queryset.filter(condition, created_at__lte=created_at).order_by('-created_at', '-id')
+    condition = models.Q(created_at__gt=created_at) | models.Q(id__gt=pk)
+    return queryset.filter(condition, created_at__gte=created_at).order_by('created_at', 'id')
@@ -0,0 +1,242 @@
+"""Per-process PostgreSQL connection pools (ENGINE chat.backends.postgresql_pool).
+
+Django opens a connection on the first query of a request and closes it when
+the request ends (CONN_MAX_AGE = 0). With the pooled backend, opening checks a
+connection out of the pool of its alias and closing gives it back, so a
+request only pays for the TCP/TLS and authentication handshake when the pool
+has to grow:
+
+- at most `max_size` connections per alias and process; a checkout waits up
+  to `timeout` seconds for one to be given back, then fails with PoolTimeout;
+- `min_size` connections are opened with the pool and kept while idle; the
+  others are closed once unused for `max_idle` seconds;
+- a connection idle for more than `ping_after` seconds is checked with
+  SELECT 1 before being handed out, and each connection is replaced after
+  about `max_lifetime` seconds (failovers, server-side memory growth);
+- a connection given back broken or inside a transaction is closed.
+
+Pools belong to the process that created them. A forked child (gunicorn
+worker) starts with empty pools and never closes the connections it
+inherited: closing them would also end the parent's sessions.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+import psycopg2
+from . import metrics
+
+logger = logging.getLogger('chat.pool')
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection was given back within the checkout timeout"""
+
+
+class ConnectionPool:
+
+    def __init__(self, alias, min_size=2, max_size=20, timeout=5.0, max_lifetime=1800.0, max_idle=300.0,
+                 ping_after=1.0):
+        self.alias = alias
+        self.min_size = min(min_size, max_size)
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.pid = os.getpid()
+        # (connection, expires_at, last_used), most recently used last
+        self._idle = deque()
+        # id(connection) -> (connection, expires_at) of the checked-out ones
+        self._checked_out = {}
+        self._cond = threading.Condition()
+        # Checked out, or being opened for a checkout
+        self.in_use = 0
+        self.waiting = 0
+        metrics.db_pool_max_size.labels(alias).set(max_size)
+
+    @property
+    def size(self):
+        return len(self._idle) + self.in_use
+
+    def getconn(self, connect):
+        """A connection for the calling thread; `connect()` opens a new one"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while not self._idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.db_pool_wait.labels(self.alias).observe(time.monotonic() - start)
+                    metrics.db_pool_events.labels(self.alias, 'timeout').inc()
+                    raise PoolTimeout(
+                        f"No connection to '{self.alias}' available within {self.timeout}s "
+                        f"({self.max_size} in use)"
+                    )
+                self.waiting += 1
+                self._update_gauges()
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            raw = expires = last_used = None
+            if self._idle:
+                raw, expires, last_used = self._idle.pop()
+            # The slot is ours from here, even while connecting
+            self.in_use += 1
+            self._update_gauges()
+        metrics.db_pool_wait.labels(self.alias).observe(time.monotonic() - start)
+
+        if raw is not None:
+            now = time.monotonic()
+            if now >= expires:
+                self._discard(raw, 'recycled')
+                raw = None
+            elif now - last_used >= self.ping_after and not self._ping(raw):
+                self._discard(raw, 'ping_failed')
+                raw = None
+        if raw is None:
+            try:
+                raw = self._open(connect)
+            except BaseException:
+                self._release()
+                raise
+            expires = self._lifetime()
+        self._checked_out[id(raw)] = (raw, expires)
+        return raw
+
+    def putconn(self, raw, reusable=True):
+        _, expires = self._checked_out.pop(id(raw), (raw, None))
+        now = time.monotonic()
+        reason = 'broken'
+        if reusable and (expires is None or now >= expires):
+            reusable, reason = False, 'recycled'
+        with self._cond:
+            self.in_use -= 1
+            if reusable:
+                self._idle.append((raw, expires, now))
+            stale = self._trim(now)
+            self._update_gauges()
+            self._cond.notify()
+        if not reusable:
+            self._discard(raw, reason)
+        for idle in stale:
+            self._discard(idle, 'idle')
+
+    def fill(self, connect):
+        """Open connections until the pool holds `min_size`"""
+        while True:
+            with self._cond:
+                if self.size >= self.min_size:
+                    return
+                self.in_use += 1
+            try:
+                raw = self._open(connect)
+            except Exception as e:
+                logger.warning("Could not open pooled connection to '%s': %s", self.alias, e)
+                self._release()
+                return
+            self._checked_out[id(raw)] = (raw, self._lifetime())
+            self.putconn(raw)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'idle': len(self._idle),
+                'in_use': self.in_use,
+                'waiting': self.waiting,
+            }
+
+    def _open(self, connect):
+        raw = connect()
+        metrics.db_pool_events.labels(self.alias, 'opened').inc()
+        return raw
+
+    def _lifetime(self):
+        # Jittered so the connections opened together are not all replaced at once
+        return time.monotonic() + self.max_lifetime * random.uniform(0.9, 1.0)
+
+    def _ping(self, raw):
+        try:
+            with raw.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not raw.autocommit:
+                raw.rollback()
+            return True
+        except psycopg2.Error as e:
+            logger.warning("Pooled connection to '%s' failed its check: %s", self.alias, e)
+            return False
+
+    def _discard(self, raw, reason):
+        metrics.db_pool_events.labels(self.alias, reason).inc()
+        try:
+            raw.close()
+        except psycopg2.Error:
+            pass
+
+    def _release(self):
+        with self._cond:
+            self.in_use -= 1
+            self._update_gauges()
+            self._cond.notify()
+
+    def _trim(self, now):
+        # Least recently used first; never below min_size
+        stale = []
+        while self._idle and self.size > self.min_size and now - self._idle[0][2] >= self.max_idle:
+            stale.append(self._idle.popleft()[0])
+        return stale
+
+    def _update_gauges(self):
+        metrics.db_pool_connections.labels(self.alias, 'idle').set(len(self._idle))
+        metrics.db_pool_connections.labels(self.alias, 'in_use').set(self.in_use)
+        metrics.db_pool_waiting.labels(self.alias).set(self.waiting)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+# Connections opened by a parent process: referenced forever so they are
+# never finalized (psycopg2 would send the server a Terminate for them)
+_inherited = []
+
+
+def get_pool(alias, options, connect=None):
+    """Pool of `alias` in this process, created (and filled in the
+    background with `connect`) on first use"""
+    pool = _pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None:
+                pool = _pools[alias] = ConnectionPool(alias, **options)
+                if connect is not None and pool.min_size > 1:
+                    threading.Thread(
+                        target=pool.fill, args=(connect,), name=f'chat-pool-{alias}', daemon=True,
+                    ).start()
+    return pool
+
+
+def forget(raw):
+    """Drop a connection inherited from the parent process without closing it"""
+    _inherited.append(raw)
+
+
+def stats():
+    return {alias: pool.stats() for alias, pool in list(_pools.items())}
+
+
+def _reset_after_fork():
+    global _pools_lock
+    # The parent's locks may have been held by threads that do not exist here
+    _pools_lock = threading.Lock()
+    for pool in _pools.values():
+        _inherited.extend(raw for raw, _, _ in pool._idle)
+        _inherited.extend(raw for raw, _ in pool._checked_out.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
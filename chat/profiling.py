@@ -0,0 +1,215 @@
+"""On-demand request profiling and slow-query capture.
+
+A request is profiled when it carries X-Profile-Token equal to PROFILE_TOKEN,
+or when it is drawn at PROFILE_SAMPLE_RATE. A profiled request records a
+cProfile profile of the worker thread (WSGI only: under ASGI the view runs on
+another thread) and every SQL statement with its duration; once the response
+is done the SELECT statements are EXPLAINed and the report is written to
+PROFILE_DIR, keeping the PROFILE_MAX_COUNT most recent reports
+(`manage.py show_profile` reads them).
+
+Independently of profiling, any query slower than SLOW_QUERY_SECONDS is
+logged with the route and the user of the request that ran it.
+"""
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DatabaseError, connections
+from .metrics import current_request
+
+logger = logging.getLogger('chat.profiling')
+
+
+class RequestProfile:
+    """Per-request state read by the query wrapper. `queries` and
+    `profiler` are None unless the request is profiled."""
+
+    def __init__(self, request, profiled=False):
+        self.request = request
+        self.id = None
+        self.queries = None
+        self.profiler = None
+        self.start = time.perf_counter()
+        if profiled:
+            self.id = f"{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(4)}"
+            self.queries = []
+            if not settings.ASYNC_VIEWS:
+                self.profiler = cProfile.Profile()
+                self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+        return time.perf_counter() - self.start
+
+    def db_seconds(self):
+        return sum(query['duration'] for query in self.queries)
+
+
+current_profile = ContextVar('chat_request_profile', default=None)
+
+
+def capture_queries(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - start
+        if profile.queries is not None:
+            profile.queries.append({
+                'alias': context['connection'].alias,
+                'sql': sql,
+                'params': params,
+                'many': many,
+                'duration': duration,
+            })
+        if settings.SLOW_QUERY_SECONDS and duration >= settings.SLOW_QUERY_SECONDS:
+            log_slow_query(profile.request, sql, duration)
+
+
+def install_query_capture(sender, connection, **kwargs):
+    # Connected in ChatConfig.ready(), before any connection is opened
+    if capture_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(capture_queries)
+
+
+def log_slow_query(request, sql, duration):
+    route = request.resolver_match.url_name if request.resolver_match else None
+    # Set by jwt_required; request.user itself may be a lazy session lookup
+    user = request.__dict__.get('_force_auth_user')
+    user_id = user.pk if user is not None else None
+    logger.warning(
+        "🐢 Slow query (%.1f ms) in %s %s (route %s, user %s): %.500s",
+        duration * 1000, request.method, request.path, route, user_id, sql,
+        extra={'http': {'route': route, 'user_id': user_id, 'duration_ms': round(duration * 1000, 2), 'sql': sql}},
+    )
+
+
+def explain(query):
+    """Plan of one captured SELECT, as text lines (None for other statements)"""
+    if query['many'] or not query['sql'].lstrip().upper().startswith(('SELECT', 'WITH', '(')):
+        return None
+    connection = connections[query['alias']]
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + query['sql'], query['params'])
+            return [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+    except DatabaseError as e:
+        return [f"EXPLAIN failed: {e}"]
+
+
+def build_report(profile, response, duration):
+    request = profile.request
+    user = request.__dict__.get('_force_auth_user')
+    queries = []
+    for index, query in enumerate(profile.queries):
+        plan = explain(query) if index < settings.PROFILE_EXPLAIN_LIMIT else None
+        queries.append({
+            'sql': query['sql'],
+            'params': repr(query['params'])[:1000],
+            'duration_ms': round(query['duration'] * 1000, 3),
+            'plan': plan,
+        })
+    report = {
+        'id': profile.id,
+        'method': request.method,
+        'path': request.get_full_path(),
+        'route': request.resolver_match.url_name if request.resolver_match else None,
+        'user_id': user.pk if user is not None else None,
+        'status': response.status_code,
+        'duration_ms': round(duration * 1000, 3),
+        'db_ms': round(profile.db_seconds() * 1000, 3),
+        'query_count': len(queries),
+        'queries': queries,
+        'profile': None,
+    }
+    if profile.profiler is not None:
+        out = io.StringIO()
+        pstats.Stats(profile.profiler, stream=out).sort_stats('cumulative').print_stats(40)
+        report['profile'] = out.getvalue()
+    return report
+
+
+class ProfileStore:
+    """Profile reports on disk: <id>.json, plus <id>.prof (pstats dump, for
+    snakeviz & co) when cProfile ran. Only the newest `max_count` are kept."""
+
+    def __init__(self, directory, max_count):
+        self.directory = directory
+        self.max_count = max_count
+        self._lock = threading.Lock()
+
+    def save(self, report, profiler=None):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, report['id'])
+        with open(f"{path}.json", 'w') as f:
+            json.dump(report, f, default=str, indent=1)
+        if profiler is not None:
+            profiler.dump_stats(f"{path}.prof")
+        self._prune()
+
+    def load(self, profile_id):
+        with open(os.path.join(self.directory, f"{os.path.basename(profile_id)}.json")) as f:
+            return json.load(f)
+
+    def recent(self):
+        """Stored ids, newest first"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            return []
+        mtimes = {}
+        for entry in entries:
+            try:
+                mtimes[entry.name[:-5]] = entry.stat().st_mtime_ns
+            except FileNotFoundError:
+                pass
+        return sorted(mtimes, key=mtimes.get, reverse=True)
+
+    def _prune(self):
+        with self._lock:
+            for profile_id in self.recent()[self.max_count:]:
+                for suffix in ('.json', '.prof'):
+                    try:
+                        os.remove(os.path.join(self.directory, profile_id + suffix))
+                    except FileNotFoundError:
+                        # Another worker pruned it first
+                        pass
+
+
+profile_store = ProfileStore(settings.PROFILE_DIR, settings.PROFILE_MAX_COUNT)
+
+
+def _detached(func, *args):
+    # EXPLAIN queries are neither captured nor counted in the request metrics
+    current_profile.set(None)
+    current_request.set(None)
+    return func(*args)
+
+
+def finish_profile(profile, response):
+    """Stop profiling and store the report; returns the request duration"""
+    duration = profile.stop()
+    if profile.id is None:
+        return duration
+    try:
+        report = contextvars.copy_context().run(_detached, build_report, profile, response, duration)
+        profile_store.save(report, profile.profiler)
+        logger.info("Profile %s stored: %s %s in %.1f ms, %s queries",
+                    profile.id, report['method'], report['path'], report['duration_ms'], report['query_count'])
+    except Exception:
+        logger.exception("Could not store profile %s", profile.id)
+    return duration
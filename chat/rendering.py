@@ -0,0 +1,53 @@
+"""Rendering of image variants, run in the chat.images process pool.
+
+Spawned pool children import this module to unpickle render_variants, so
+it must not import Django (nor anything in chat that does): only the
+standard library and Pillow.
+"""
+import os
+
+# name -> (longest side in pixels, Pillow format, file extension)
+VARIANTS = {
+    'thumb': (320, 'JPEG', 'jpg'),
+    'thumb_webp': (320, 'WEBP', 'webp'),
+    'medium': (1280, 'JPEG', 'jpg'),
+    'medium_webp': (1280, 'WEBP', 'webp'),
+}
+
+
+def variant_name(image_name, variant, ext):
+    """images/ab/cd/name.png -> variants/ab/cd/name_thumb.jpg"""
+    directory, filename = os.path.split(image_name)
+    parts = directory.split('/', 1)
+    subdir = parts[1] if len(parts) > 1 else ''
+    stem = os.path.splitext(filename)[0]
+    return os.path.join('variants', subdir, f"{stem}_{variant}.{ext}")
+
+
+def render_variants(source_path, media_root, image_name):
+    """Render every variant of one image. Runs in a pool process.
+
+    Returns {variant: storage name}. Variants are never upscaled.
+    """
+    from PIL import Image, ImageOps
+
+    rendered = {}
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        for variant, (size, image_format, ext) in VARIANTS.items():
+            image = original.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            if image_format == 'JPEG':
+                image = image.convert('RGB')
+            elif image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+            name = variant_name(image_name, variant, ext)
+            path = os.path.join(media_root, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so readers never see a partial file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            image.save(tmp_path, image_format, quality=80 if image_format == 'WEBP' else 85, optimize=True)
+            os.replace(tmp_path, path)
+            rendered[variant] = name
+    return rendered
@@ -0,0 +1,160 @@
+"""Read replicas with read-your-writes stickiness.
+
+ReplicaRoutingMiddleware gives every request a Route: GET/HEAD/OPTIONS
+requests read from a replica unless their user is pinned to the primary.
+Any write switches the rest of the request to the primary and pins the
+users it wrote for (the authenticated user, users saved by the request)
+for REPLICA_STICKY_SECONDS in the Django cache, so they keep reading the
+primary until their writes have reached the replicas. The pin must be seen
+by every worker: with several workers the cache has to be shared
+(REDIS_URL); the per-process LocMemCache fallback only holds the pin in the
+worker that handled the write.
+
+Each process reads from one replica at a time, re-checked every
+REPLICA_CHECK_INTERVAL seconds: a replica that fails the check or lags more
+than REPLICA_MAX_LAG_SECONDS leaves the rotation until it recovers, and
+with none left reads go to the primary. Code running outside a request
+(management commands, background threads) always uses the primary.
+"""
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger('chat.routers')
+
+PIN_KEY = 'chat:primary-pin:%s'
+
+# Seconds since the last replayed transaction, 0 when the replica has
+# replayed everything it received (an idle primary writes no transactions)
+POSTGRES_LAG_SQL = (
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+)
+
+
+class Route:
+    """Database routing state of one request"""
+
+    def __init__(self, replica):
+        self.replica = replica
+        self.alias = None
+        self.wrote = False
+        self.users = []
+
+
+current_route = ContextVar('chat_db_route', default=None)
+
+
+class ReplicaSet:
+
+    def __init__(self, aliases, max_lag, check_interval):
+        self.aliases = list(aliases)
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lags = {}
+        self.healthy = []
+        self.current = None
+        self._checked = None
+        self._lock = threading.Lock()
+
+    def choose(self):
+        """Replica alias to read from, or None for the primary"""
+        if self._checked is None or time.monotonic() - self._checked >= self.check_interval:
+            # One thread checks, the others keep the current choice meanwhile
+            if self._lock.acquire(blocking=False):
+                try:
+                    self.check()
+                finally:
+                    self._lock.release()
+        return self.current
+
+    def check(self):
+        healthy = []
+        for alias in self.aliases:
+            lag = self._lag(alias)
+            if lag is not None and lag <= self.max_lag:
+                healthy.append(alias)
+                if alias not in self.healthy and self._checked is not None:
+                    logger.info("Replica %s back in rotation (lag %.1fs)", alias, lag)
+            elif alias in self.healthy or self._checked is None:
+                logger.warning("Replica %s out of rotation (lag: %s)", alias, 'unreachable' if lag is None else f'{lag:.1f}s')
+            self.lags[alias] = lag
+        self.healthy = healthy
+        # Stay on one replica so per-process caches (chat.timeline) never
+        # see the newest rows go back to an older, more lagging replica
+        if self.current not in healthy:
+            self.current = random.choice(healthy) if healthy else None
+            logger.info("Reading from %s", self.current or 'the primary')
+        self._checked = time.monotonic()
+
+    def _lag(self, alias):
+        connection = connections[alias]
+        try:
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute(POSTGRES_LAG_SQL)
+                    return float(cursor.fetchone()[0])
+                cursor.execute('SELECT 1')
+                return 0.0
+        except DatabaseError as e:
+            logger.warning("Replica %s check failed: %s", alias, e)
+            connection.close()
+            return None
+
+
+replicas = ReplicaSet(settings.DATABASE_REPLICAS, settings.REPLICA_MAX_LAG_SECONDS, settings.REPLICA_CHECK_INTERVAL)
+
+
+def is_pinned(user_id):
+    return cache.get(PIN_KEY % user_id) is not None
+
+
+def pin_to_primary(user_ids):
+    if user_ids and settings.REPLICA_STICKY_SECONDS > 0:
+        cache.set_many({PIN_KEY % user_id: 1 for user_id in user_ids}, settings.REPLICA_STICKY_SECONDS)
+
+
+def reads_primary_over_replicas():
+    """True when replicas are configured but this request reads the primary
+    (it wrote, or its user is pinned)"""
+    route = current_route.get()
+    return bool(replicas.aliases) and (route is None or not route.replica)
+
+
+class ReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        route = current_route.get()
+        if route is None or not route.replica or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        if route.alias is None:
+            # Chosen once: all reads of the request see the same replica
+            route.alias = replicas.choose() or DEFAULT_DB_ALIAS
+        return route.alias
+
+    def db_for_write(self, model, **hints):
+        route = current_route.get()
+        if route is not None:
+            route.replica = False
+            route.wrote = True
+            instance = hints.get('instance')
+            if instance is not None and model._meta.label == settings.AUTH_USER_MODEL:
+                # Its pk is only known after the insert (register)
+                route.users.append(instance)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas.aliases}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema from the primary
+        return False if db in replicas.aliases else None
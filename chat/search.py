@@ -0,0 +1,91 @@
+"""Full-text search over message content (GET /messages/search).
+
+The index lives outside the Django model (see migration 0007):
+
+- PostgreSQL: `search_vector`, a tsvector column computed from `content`
+  by a trigger with the 'simple' configuration (no stemming, works for any
+  language), indexed with GIN;
+- SQLite: `chat_message_fts`, an FTS5 table over `content` whose rows are
+  the message ids, kept in sync by triggers.
+
+Both match every word of the query, rank with the engine's relevance
+function (ts_rank_cd, bm25) and page with a (score, id) keyset. On
+PostgreSQL ts_rank_cd only depends on the message and the query, so a
+cursor stays valid while new messages arrive. On SQLite bm25 depends on
+statistics of the whole index (message count, average length, term
+frequencies): scores shift as messages are added or deleted, and a later
+page may repeat or skip results. SQLite only serves local runs.
+"""
+import re
+from django.db import connections
+from .models import Message
+from .pagination import InvalidCursor, decode_token, encode_token
+
+SEARCH_CONFIG = 'simple'
+FTS_TABLE = 'chat_message_fts'
+MAX_QUERY_LENGTH = 200
+MAX_TERMS = 16
+
+WORD = re.compile(r'\w+')
+
+
+def search_terms(text):
+    """Words of a search query; ValueError when there is nothing to search"""
+    if len(text) > MAX_QUERY_LENGTH:
+        raise ValueError(f"Search query longer than {MAX_QUERY_LENGTH} characters")
+    terms = WORD.findall(text.lower())
+    if not terms:
+        raise ValueError("Missing search query")
+    if len(terms) > MAX_TERMS:
+        raise ValueError(f"At most {MAX_TERMS} search terms")
+    return terms
+
+
+def encode_search_cursor(score, pk):
+    return encode_token(f"{score!r}|{pk}")
+
+
+def decode_search_cursor(token):
+    raw = decode_token(token)
+    try:
+        score, pk = raw.rsplit('|', 1)
+        return float(score), int(pk)
+    except ValueError:
+        raise InvalidCursor(token)
+
+
+def search_messages(user, terms, after=None, limit=50):
+    """[(id, score)] of the messages visible to `user` containing every term,
+    best first (newest first among equal scores), after the `after` position"""
+    connection = connections[Message.objects.db]
+    table = connection.ops.quote_name(Message._meta.db_table)
+    if connection.vendor == 'postgresql':
+        matches = (
+            f"SELECT m.id, ts_rank_cd(m.search_vector, q)::float8 AS score "
+            f"FROM {table} m, plainto_tsquery('{SEARCH_CONFIG}', %s) q "
+            f"WHERE m.search_vector @@ q"
+        )
+        params = [' '.join(terms)]
+    elif connection.vendor == 'sqlite':
+        # bm25() is lower for better matches; negated to sort like ts_rank_cd
+        matches = (
+            f"SELECT m.id AS id, -bm25({FTS_TABLE}) AS score "
+            f"FROM {FTS_TABLE} JOIN {table} m ON m.id = {FTS_TABLE}.rowid "
+            f"WHERE {FTS_TABLE} MATCH %s"
+        )
+        # Each term quoted: FTS5 operators typed by the user stay plain words
+        params = [' '.join(f'"{term}"' for term in terms)]
+    else:
+        raise NotImplementedError(f"Message search is not available on {connection.vendor}")
+
+    matches += " AND (m.to_user_id IS NULL OR m.from_user_id = %s OR m.to_user_id = %s)"
+    params += [user.id, user.id]
+    sql = f"SELECT id, score FROM ({matches}) matches"
+    if after is not None:
+        sql += " WHERE score < %s OR (score = %s AND id < %s)"
+        params += [after[0], after[0], after[1]]
+    sql += " ORDER BY score DESC, id DESC LIMIT %s"
+    params.append(limit)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
@@ -35,21 +35,62 @@ class SendMessageSerializer(serializers.Serializer):
     to = serializers.IntegerField(required=False, help_text="ID de l'utilisateur destinataire (optionnel pour message public)")
     image = MessageImageSerializer(required=False, help_text="Image optionnelle")
 
+class SendMessageMultipartSerializer(serializers.Serializer):
+    """Serializer pour l'envoi de messages en multipart/form-data (image transmise en flux)"""
+    content = serializers.CharField(help_text="Contenu du message")
+    to = serializers.IntegerField(required=False, help_text="ID de l'utilisateur destinataire (optionnel pour message public)")
+    image = serializers.ImageField(required=False, help_text="Fichier image optionnel")
+
+class SendMessageBatchSerializer(serializers.Serializer):
+    """Serializer pour l'envoi groupé de messages"""
+    messages = SendMessageSerializer(many=True, help_text="Messages à envoyer (au plus MESSAGE_BATCH_MAX)")
+
+class MessageBatchResultSerializer(serializers.Serializer):
+    """Serializer pour le résultat d'un message d'un envoi groupé"""
+    index = serializers.IntegerField(help_text="Position du message dans la requête")
+    success = serializers.BooleanField(help_text="Indique si le message a été enregistré")
+    id = serializers.IntegerField(required=False, help_text="Identifiant du message créé")
+    error = serializers.CharField(required=False, help_text="Raison du refus du message")
+
+class MessageBatchResponseSerializer(serializers.Serializer):
+    """Serializer pour la réponse d'un envoi groupé"""
+    success = serializers.BooleanField(help_text="Indique si au moins un message a été enregistré")
+    created = serializers.IntegerField(help_text="Nombre de messages enregistrés")
+    results = MessageBatchResultSerializer(many=True, help_text="Résultat de chaque message, dans l'ordre de la requête")
+
 class MessageResponseSerializer(serializers.Serializer):
     """Serializer pour les messages retournés"""
+    id = serializers.IntegerField(help_text="Identifiant du message")
     content = serializers.CharField(help_text="Contenu du message")
     from_user = UserSerializer(source='from', help_text="Expéditeur du message")
     to_user = UserSerializer(source='to', required=False, help_text="Destinataire du message (null pour message public)")
-    image = serializers.URLField(required=False, help_text="URL de l'image si présente")
+    image = serializers.URLField(required=False, help_text="URL de l'image si présente (signée et temporaire pour un message privé)")
+    thumbnail = serializers.URLField(required=False, help_text="URL de la miniature (WebP) une fois générée")
+    variants = serializers.DictField(child=serializers.URLField(), required=False, help_text="URLs des versions redimensionnées (thumb, medium, *_webp)")
     created_at = serializers.DateTimeField(help_text="Date de création du message")
 
 class UsersResponseSerializer(serializers.Serializer):
     """Serializer pour la liste des utilisateurs"""
-    users = UserSerializer(many=True, help_text="Liste de tous les utilisateurs")
+    users = UserSerializer(many=True, help_text="Utilisateurs de la page, triés par nom")
+    has_more = serializers.BooleanField(help_text="Indique si d'autres utilisateurs sont disponibles")
+    next_cursor = serializers.CharField(allow_null=True, help_text="Curseur à passer dans after= pour la page suivante")
 
 class MessagesResponseSerializer(serializers.Serializer):
     """Serializer pour la liste des messages"""
     messages = MessageResponseSerializer(many=True, help_text="Liste des messages accessibles à l'utilisateur")
+    has_more = serializers.BooleanField(help_text="Indique si d'autres messages sont disponibles au-delà de cette page")
+    next_cursor = serializers.CharField(allow_null=True, help_text="Curseur opaque pour la page suivante (plus anciens, ou plus récents en mode since ; en mode since il reste FEED_SETTLE_SECONDS derrière le plus récent, dédupliquer par id)")
+    sync_cursor = serializers.CharField(required=False, allow_null=True, help_text="Curseur à passer dans since pour ne recevoir que les nouveaux messages ; il reste FEED_SETTLE_SECONDS derrière le plus récent, les messages plus récents sont renvoyés au poll suivant et doivent être dédupliqués par id")
+
+class MessageSearchHitSerializer(MessageResponseSerializer):
+    """Serializer pour un message trouvé par la recherche"""
+    score = serializers.FloatField(help_text="Pertinence du message pour la recherche (plus élevé = plus pertinent)")
+
+class MessageSearchResponseSerializer(serializers.Serializer):
+    """Serializer pour les résultats de recherche"""
+    messages = MessageSearchHitSerializer(many=True, help_text="Messages accessibles contenant tous les mots recherchés, du plus pertinent au moins pertinent")
+    has_more = serializers.BooleanField(help_text="Indique si d'autres résultats sont disponibles")
+    next_cursor = serializers.CharField(allow_null=True, help_text="Curseur à passer dans after= pour la page suivante")
 
 class SuccessResponseSerializer(serializers.Serializer):
     """Serializer pour les réponses de succès"""
@@ -0,0 +1,62 @@
+from collections import Counter
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .authentication import user_cache
+from .conditional import FEED_GENERATION_KEY, USERS_GENERATION_KEY, bump_generation
+from .events import publish_message, publish_messages
+from .images import schedule_variants
+from .models import ArchivedMessage, Message
+from .storage import release_blob, retain_blob
+from .timeline import public_timeline
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Covers renames, password changes and deactivation (is_active=False)
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_listing_changed(sender, instance, created=False, update_fields=None, **kwargs):
+    # Logins save last_login only; new users already move the /users ETag
+    if created or (update_fields is not None and 'username' not in update_fields):
+        return
+    bump_generation(USERS_GENERATION_KEY, FEED_GENERATION_KEY)
+
+
+@receiver(post_save, sender=Message)
+def message_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+    if instance.image:
+        retain_blob(instance.image.name)
+    publish_message(instance)
+    schedule_variants(instance)
+    if instance.to_user_id is None:
+        transaction.on_commit(public_timeline.refresh)
+
+
+def messages_bulk_created(messages):
+    """message_created for rows inserted with bulk_create(), which sends no
+    post_save. Call it inside the inserting transaction."""
+    for name, count in Counter(message.image.name for message in messages if message.image).items():
+        retain_blob(name, count)
+    publish_messages(messages)
+    for message in messages:
+        schedule_variants(message)
+    if any(message.to_user_id is None for message in messages):
+        transaction.on_commit(public_timeline.refresh)
+
+
+@receiver(post_delete, sender=Message)
+@receiver(post_delete, sender=ArchivedMessage)
+def message_deleted(sender, instance, **kwargs):
+    bump_generation(FEED_GENERATION_KEY)
+    if instance.image:
+        release_blob(instance.image.name)
@@ -0,0 +1,127 @@
+"""Content-addressed image storage.
+
+In 'content' mode (IMAGE_STORAGE_MODE) an upload is named after the SHA-256
+of its bytes and sharded two levels deep: images/ab/cd/abcd....png. Identical
+uploads map to the same file, which is written once. ImageBlob keeps a
+reference count per stored name so the file (and its variants) is removed
+only when the last message using it is deleted.
+
+Saving a name that may already be stored locks its ImageBlob row first, and
+Message.save() keeps that lock until its post_save signal has counted the
+new reference: a collection (_collect_blob) of the same name either waits
+for the count or has already deleted the file, which is then written again.
+"""
+import hashlib
+import logging
+import os
+import uuid
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, models, transaction
+
+logger = logging.getLogger('chat.storage')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        return super().save(self.content_name(name, content), content, max_length)
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = digest.hexdigest()
+        ext = os.path.splitext(name)[1].lower().lstrip('.')
+        ext = ext if ext.isalnum() else 'bin'
+        return os.path.join('images', digest[:2], digest[2:4], f"{digest}.{ext}")
+
+    def get_available_name(self, name, max_length=None):
+        # Same name means same bytes: never rename, _save() reuses the file
+        return name
+
+    def _save(self, name, content):
+        from .models import ImageBlob
+
+        with transaction.atomic():
+            # Waits for a collection of this name in progress; inside the
+            # caller's transaction, keeps one from starting until it ends
+            ImageBlob.objects.select_for_update().filter(name=name).values_list('name', flat=True).first()
+            if self.exists(name):
+                return name
+            return self._write(name, content)
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # Concurrent uploads of the same image write the same bytes; the
+        # temporary file plus rename keeps readers from seeing a partial one.
+        tmp_path = f"{full_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(tmp_path, 'wb') as destination:
+                for chunk in content.chunks():
+                    destination.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            os.replace(tmp_path, full_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return name
+
+
+content_storage = ContentAddressedStorage()
+
+
+def image_storage():
+    """Storage of Message.image, chosen by IMAGE_STORAGE_MODE ('content' or 'uuid')"""
+    if settings.IMAGE_STORAGE_MODE == 'content':
+        return content_storage
+    return default_storage
+
+
+def retain_blob(name, count=1):
+    """Count `count` more messages referencing the stored image `name`"""
+    from .models import ImageBlob
+
+    if ImageBlob.objects.filter(name=name).update(refcount=models.F('refcount') + count):
+        return
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(name=name, refcount=count)
+    except IntegrityError:
+        ImageBlob.objects.filter(name=name).update(refcount=models.F('refcount') + count)
+
+
+def release_blob(name):
+    """Drop one reference to `name`; the files go once nothing refers to them"""
+    from .models import ImageBlob
+
+    ImageBlob.objects.filter(name=name).update(refcount=models.F('refcount') - 1)
+    transaction.on_commit(lambda: _collect_blob(name))
+
+
+def _collect_blob(name):
+    from .rendering import VARIANTS, variant_name
+    from .models import ImageBlob, Message
+
+    storage = Message._meta.get_field('image').storage
+    with transaction.atomic():
+        # The row lock makes a concurrent save of the same name (_save) or
+        # retain_blob() wait until the blob is either kept or gone (files
+        # included), so they then write the file again and recreate the
+        # blob at refcount 1. The refcount is read under that lock.
+        blob = ImageBlob.objects.select_for_update().filter(name=name).first()
+        if blob is None or blob.refcount > 0:
+            return
+        blob.delete()
+        for variant, (_, _, ext) in VARIANTS.items():
+            storage.delete(variant_name(name, variant, ext))
+        storage.delete(name)
+    logger.info("Deleted unreferenced image %s", name)
@@ -0,0 +1,55 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+
+
+def client_ip(request):
+    if settings.THROTTLE_TRUST_X_REAL_IP:
+        # Set by nginx in front of the API; only enabled where gunicorn is
+        # not reachable without it
+        ip = request.META.get('HTTP_X_REAL_IP')
+        if ip:
+            return ip
+    return request.META.get('REMOTE_ADDR', 'unknown')
+
+
+class Throttle:
+    """Fixed-window attempt counter stored in the Django cache.
+
+    With the shared cache (REDIS_URL) every worker counts against the same
+    limit; with the per-process LocMemCache each worker counts on its own,
+    so a client may make up to `limit` attempts per worker process.
+    """
+
+    def __init__(self, scope, limit, window):
+        self.scope = scope
+        self.limit = limit
+        self.window = window
+
+    def _key(self, ident):
+        digest = hashlib.sha256(str(ident).encode('utf-8')).hexdigest()[:32]
+        return f"throttle:{self.scope}:{digest}"
+
+    def is_blocked(self, ident):
+        return self.limit > 0 and cache.get(self._key(ident), 0) >= self.limit
+
+    def hit(self, ident):
+        key = self._key(ident)
+        cache.add(key, 0, self.window)
+        try:
+            return cache.incr(key)
+        except ValueError:
+            # Expired between add() and incr()
+            cache.set(key, 1, self.window)
+            return 1
+
+    def reset(self, ident):
+        cache.delete(self._key(ident))
+
+
+# Every login attempt counts against the client IP; only failures count
+# against the username, so a legitimate user is not locked out by traffic
+# from other addresses once they log in successfully.
+login_ip_throttle = Throttle('login-ip', settings.LOGIN_IP_LIMIT, settings.LOGIN_IP_WINDOW)
+login_username_throttle = Throttle('login-user', settings.LOGIN_USERNAME_FAILURE_LIMIT, settings.LOGIN_USERNAME_WINDOW)
+register_ip_throttle = Throttle('register-ip', settings.REGISTER_IP_LIMIT, settings.REGISTER_IP_WINDOW)
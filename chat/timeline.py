@@ -0,0 +1,222 @@
+"""Per-process buffer of the most recent public messages.
+
+Public messages are the same for every user, so each worker keeps the
+newest ones already serialized and only private messages are read from the
+database per request. The buffer is kept coherent with the database through
+a change sequence: the newest public (created_at, id), which every feed
+request already reads for its ETag, plus the feed generation counter bumped
+on deletes, renames and new image variants. When the head moves the buffer
+fetches only the public rows it is missing; when the generation moves it is
+reloaded. The counter must be shared by every worker (REDIS_URL): without a
+shared cache the buffer is off by default, since a delete, rename or new
+image variant handled by one worker would never reach the others' buffers.
+Lookups, refills and evictions are exported by chat.metrics.
+"""
+import bisect
+import json
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from . import metrics
+from .conditional import FEED_GENERATION_KEY, generation
+from .pagination import keyset_filter
+from .routers import reads_primary_over_replicas, replicas
+
+logger = logging.getLogger('chat.timeline')
+
+
+class PublicTimeline:
+
+    def __init__(self, capacity, max_bytes, settle_seconds):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        # Rows can commit slightly out of created_at order; catching up
+        # re-reads this far behind the last known head.
+        self.settle = timedelta(seconds=settle_seconds)
+        self._lock = threading.Lock()
+        self._keys = []     # (created_at, id), ascending
+        self._rows = []     # feed rows with their encoded JSON under '_json'
+        self._ids = set()
+        self._bytes = 0
+        self._head = None   # last public head confirmed against the database
+        self._generation = None
+        # True while no public message older than the buffer exists
+        self._complete = False
+        self.hits = 0
+        self.misses = 0
+        self.catch_ups = 0
+        self.reloads = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def page(self, head, position, direction, count):
+        """Public rows of one feed page in feed order, or None if the buffer
+        cannot serve it and the caller must query the database.
+
+        `head` is the newest public message as {'id', 'created_at'} (None
+        when there is none), read by the caller in the same request.
+        """
+        # With replicas the buffer follows the replica this process reads
+        # from; requests reading the primary are ahead of it
+        if not self.enabled or reads_primary_over_replicas():
+            return None
+        with self._lock:
+            self._sync(head)
+            rows = self._select(position, direction, count)
+            if rows is None:
+                self.misses += 1
+                metrics.timeline_lookups.labels('miss').inc()
+            else:
+                self.hits += 1
+                metrics.timeline_lookups.labels('hit').inc()
+            return rows
+
+    def refresh(self):
+        """Catch up right after a public message is written in this process"""
+        if not self.enabled or self._generation is None or replicas.aliases:
+            return
+        head = self._read_head()
+        with self._lock:
+            self._sync(head)
+
+    def warm(self):
+        """Load the buffer before the first request (gunicorn master, before
+        forking the workers that inherit it)"""
+        if not self.enabled or replicas.aliases:
+            return
+        head = self._read_head()
+        with self._lock:
+            self._sync(head)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._rows),
+                'bytes': self._bytes,
+                'complete': self._complete,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'catch_ups': self.catch_ups,
+                'reloads': self.reloads,
+                'evictions': self.evictions,
+            }
+
+    def _sync(self, head):
+        current = generation(FEED_GENERATION_KEY)
+        head_key = (head['created_at'], head['id']) if head else None
+        if current != self._generation or (self._head is None and head_key is not None):
+            self._reload(current)
+        elif head_key is None:
+            if self._rows:
+                self._reload(current)
+        elif head_key != self._head:
+            if head_key < self._head:
+                # The newest public message went away without a generation bump
+                self._reload(current)
+            else:
+                self._catch_up()
+        self._head = head_key
+
+    def _read_head(self):
+        from .models import Message
+        return (
+            Message.objects.filter(to_user__isnull=True)
+            .order_by('-created_at', '-id').values('id', 'created_at').first()
+        )
+
+    def _public_rows(self):
+        from .models import Message
+        from .views import FEED_FIELDS
+        return Message.objects.filter(to_user__isnull=True).values(*FEED_FIELDS)
+
+    def _reload(self, current):
+        rows = list(self._public_rows().order_by('-created_at', '-id')[:self.capacity])
+        rows.reverse()
+        self._keys, self._rows, self._ids, self._bytes = [], [], set(), 0
+        for row in rows:
+            self._append(row)
+        self._complete = len(rows) < self.capacity
+        self._generation = current
+        self.reloads += 1
+        metrics.timeline_refills.labels('reload').inc()
+        self._trim()
+        logger.info("Public timeline reloaded: %s messages, %s bytes", len(self._rows), self._bytes)
+
+    def _catch_up(self):
+        created_at, _ = self._head
+        since = (created_at - self.settle, 0)
+        rows = list(keyset_filter(self._public_rows(), since, 'since')[:self.capacity + 1])
+        if len(rows) > self.capacity:
+            self._reload(self._generation)
+            return
+        for row in rows:
+            if row['id'] not in self._ids:
+                self._insert(row)
+        self.catch_ups += 1
+        metrics.timeline_refills.labels('catch_up').inc()
+        self._trim()
+
+    def _encode(self, row):
+        from .views import _serialize_feed_row
+        row['_json'] = json.dumps(_serialize_feed_row(row)).encode('utf-8')
+        return len(row['_json'])
+
+    def _append(self, row):
+        self._bytes += self._encode(row)
+        self._keys.append((row['created_at'], row['id']))
+        self._rows.append(row)
+        self._ids.add(row['id'])
+
+    def _insert(self, row):
+        key = (row['created_at'], row['id'])
+        index = bisect.bisect_left(self._keys, key)
+        self._bytes += self._encode(row)
+        self._keys.insert(index, key)
+        self._rows.insert(index, row)
+        self._ids.add(row['id'])
+
+    def _trim(self):
+        count, size, excess = len(self._rows), self._bytes, 0
+        metrics.timeline_rows.set(count)
+        metrics.timeline_bytes.set(size)
+        while excess < count and (count - excess > self.capacity or size > self.max_bytes):
+            size -= len(self._rows[excess]['_json'])
+            excess += 1
+        if not excess:
+            return
+        for row in self._rows[:excess]:
+            self._ids.discard(row['id'])
+        del self._keys[:excess]
+        del self._rows[:excess]
+        self._bytes = size
+        self._complete = False
+        self.evictions += excess
+        metrics.timeline_evictions.inc(excess)
+        metrics.timeline_rows.set(len(self._rows))
+        metrics.timeline_bytes.set(size)
+
+    def _select(self, position, direction, count):
+        if direction == 'before':
+            end = len(self._keys) if position is None else bisect.bisect_left(self._keys, position)
+            start = max(end - count, 0)
+            # Older public rows outside the buffer could belong to this page
+            if end - start < count and not self._complete:
+                return None
+            return self._rows[start:end][::-1]
+        if not self._complete and (not self._keys or position < self._keys[0]):
+            return None
+        start = bisect.bisect_right(self._keys, position)
+        return self._rows[start:start + count]
+
+
+public_timeline = PublicTimeline(
+    settings.PUBLIC_TIMELINE_SIZE,
+    settings.PUBLIC_TIMELINE_MAX_BYTES,
+    settings.PUBLIC_TIMELINE_SETTLE_SECONDS,
+)
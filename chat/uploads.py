@@ -0,0 +1,112 @@
+import json
+from django.conf import settings
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """Write file parts to a temporary file chunk by chunk (never in memory)
+    and stop reading the body once MESSAGE_UPLOAD_MAX_BYTES is exceeded,
+    which also covers chunked requests without a Content-Length."""
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.received = 0
+        self.exceeded = False
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.MESSAGE_UPLOAD_MAX_BYTES:
+            self.exceeded = True
+            raise StopUpload(connection_reset=True)
+        return super().receive_data_chunk(raw_data, start)
+
+
+def read_multipart_message(request):
+    """Parse a multipart/form-data send request (a Django HttpRequest).
+
+    Returns (content, to, image) where image is an UploadedFile backed by a
+    temporary file, or None. Raises UploadTooLarge before reading anything
+    when the declared Content-Length is already over the limit. Under ASGI
+    the handler has spooled the whole body before the view runs: there,
+    BodySizeLimit enforces the limit while the body is received.
+    """
+    try:
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        content_length = 0
+    if content_length > settings.MESSAGE_UPLOAD_MAX_BYTES:
+        raise UploadTooLarge(content_length)
+
+    handler = LimitedTemporaryFileUploadHandler(request)
+    request.upload_handlers = [handler]
+    post, files = request.POST, request.FILES
+    if handler.exceeded:
+        raise UploadTooLarge(handler.received)
+    return post.get('content'), post.get('to'), files.get('image')
+
+
+class BodySizeLimit:
+    """ASGI middleware refusing request bodies over `max_bytes` with a 413.
+
+    Django's ASGI handler reads the whole body before any view or Django
+    middleware runs, so their checks only happen once it has been received.
+    This one answers on the declared Content-Length, or as soon as the
+    received chunks go over the limit (chunked requests), without reading
+    the rest.
+    """
+
+    def __init__(self, app, max_bytes):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.body = json.dumps({
+            'success': False,
+            'error': f'Request body exceeds {max_bytes} bytes'
+        }).encode('utf-8')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        for name, value in scope.get('headers', ()):
+            if name == b'content-length':
+                try:
+                    too_large = int(value) > self.max_bytes
+                except ValueError:
+                    too_large = False
+                if too_large:
+                    return await self._refuse(send)
+                break
+
+        received = 0
+        refused = False
+
+        async def limited_receive():
+            nonlocal received, refused
+            if refused:
+                return {'type': 'http.disconnect'}
+            message = await receive()
+            if message['type'] == 'http.request':
+                received += len(message.get('body', b''))
+                if received > self.max_bytes:
+                    refused = True
+                    await self._refuse(send)
+                    # Django stops reading the body and sends nothing
+                    return {'type': 'http.disconnect'}
+            return message
+
+        return await self.app(scope, limited_receive, send)
+
+    async def _refuse(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(self.body)).encode()),
+                (b'connection', b'close'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': self.body})
@@ -1,10 +1,21 @@
+from django.conf import settings
 from django.urls import path
 from . import views, home_views
 
+if settings.ASYNC_VIEWS:
+    from . import async_views as api_views
+else:
+    api_views = views
+
 urlpatterns = [
     path('', home_views.home, name='home'),
-    path('register', views.register, name='register'),
-    path('login', views.login, name='login'),
-    path('users', views.users, name='users'),
-    path('messages', views.messages_handler, name='messages'),
+    path('register', api_views.register, name='register'),
+    path('login', api_views.login, name='login'),
+    path('users', api_views.users, name='users'),
+    path('messages', api_views.messages_handler, name='messages'),
+    path('messages/batch', views.send_message_batch, name='message-batch'),
+    path('messages/search', views.message_search, name='message-search'),
+    path('messages/stream', api_views.message_stream, name='message-stream'),
+    path('messages/<int:message_id>/image', views.message_image, name='message-image'),
+    path('metrics', views.metrics, name='metrics'),
 ]
\ No newline at end of file
@@ -1,20 +1,46 @@
 import json
 import base64
+import binascii
+import heapq
+import itertools
 import logging
-from django.http import JsonResponse
+import mimetypes
+import queue
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.contrib.auth import authenticate
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_safe
 from django.core.files.base import ContentFile
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.db import connection, connections, models, transaction
 from rest_framework.decorators import api_view
 from drf_spectacular.utils import extend_schema, OpenApiExample
 from drf_spectacular.openapi import OpenApiParameter
-from .models import Message
-from .authentication import create_jwt_token, jwt_required
+from .models import ArchivedMessage, Message
+from .authentication import authenticate_request, create_jwt_token, jwt_required
+from .conditional import feed_etag, not_modified, set_validators, users_etag
+from .events import RecentIds, format_event, hub
+from .hashing import Overloaded, hashing
+from .media import accel_redirect_path, image_url, verify_signature
+from .metrics import render as render_metrics
+from .signals import messages_bulk_created
+from .pagination import (
+    InvalidCursor, decode_cursor, decode_token, encode_cursor, encode_token, keyset_filter, parse_limit,
+)
+from .search import decode_search_cursor, encode_search_cursor, search_messages, search_terms
+from .uploads import UploadTooLarge, read_multipart_message
+from .timeline import public_timeline
+from .throttling import client_ip, login_ip_throttle, login_username_throttle, register_ip_throttle
 from .serializers import (
     RegisterSerializer, LoginSerializer, LoginResponseSerializer,
-    SendMessageSerializer, UsersResponseSerializer, MessagesResponseSerializer,
+    SendMessageSerializer, SendMessageMultipartSerializer, UsersResponseSerializer, MessagesResponseSerializer,
+    SendMessageBatchSerializer, MessageBatchResponseSerializer, MessageSearchResponseSerializer,
     SuccessResponseSerializer, ErrorResponseSerializer
 )
 
@@ -22,6 +48,28 @@ logger = logging.getLogger('chat.views')
 
 User = get_user_model()
 
+def throttled_response(retry_after, success_flag=False):
+    body = {'error': 'Too many attempts, try again later'}
+    if success_flag:
+        body['success'] = False
+    response = JsonResponse(body, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def overloaded_response(success_flag=False):
+    body = {'error': 'Server busy, try again later'}
+    if success_flag:
+        body['success'] = False
+    response = JsonResponse(body, status=503)
+    response['Retry-After'] = '1'
+    return response
+
+def upload_too_large_response():
+    return JsonResponse({
+        'success': False,
+        'error': f'Request body exceeds {settings.MESSAGE_UPLOAD_MAX_BYTES} bytes'
+    }, status=413)
+
 @extend_schema(
     operation_id='register_user',
     summary='Inscription d\'un nouvel utilisateur',
@@ -30,6 +78,8 @@ User = get_user_model()
     responses={
         200: SuccessResponseSerializer,
         400: ErrorResponseSerializer,
+        429: ErrorResponseSerializer,
+        503: ErrorResponseSerializer,
     },
     examples=[
         OpenApiExample(
@@ -45,43 +95,56 @@ User = get_user_model()
 @api_view(['POST'])
 def register(request):
     logger.info("=== REGISTER REQUEST ===")
-    logger.info(f"Request method: {request.method}")
-    logger.info(f"Content-Type: {request.META.get('CONTENT_TYPE', 'N/A')}")
-    logger.info(f"Origin: {request.META.get('HTTP_ORIGIN', 'N/A')}")
+    logger.info("Request method: %s", request.method)
+    logger.info("Content-Type: %s", request.META.get('CONTENT_TYPE', 'N/A'))
+    logger.info("Origin: %s", request.META.get('HTTP_ORIGIN', 'N/A'))
     
     try:
         data = json.loads(request.body)
         username = data.get('username')
         password = data.get('password')
         
-        logger.info(f"Registration attempt for username: {username}")
+        logger.info("Registration attempt for username: %s", username)
         
         if not username or not password:
-            logger.warning(f"Missing credentials - username: {bool(username)}, password: {bool(password)}")
+            logger.warning("Missing credentials - username: %s, password: %s", bool(username), bool(password))
             return JsonResponse({
                 'success': False,
                 'error': 'Username and password are required'
             }, status=400)
         
+        ip = client_ip(request)
+        if register_ip_throttle.is_blocked(ip):
+            logger.warning("Registration throttled for IP %s", ip)
+            return throttled_response(register_ip_throttle.window, success_flag=True)
+        
         if User.objects.filter(username=username).exists():
-            logger.warning(f"Registration failed - username '{username}' already exists")
+            logger.warning("Registration failed - username '%s' already exists", username)
             return JsonResponse({
                 'success': False,
                 'error': 'Username already exists'
             }, status=400)
         
-        user = User.objects.create_user(username=username, password=password)
-        logger.info(f"User '{username}' registered successfully with ID: {user.id}")
+        register_ip_throttle.hit(ip)
+        # Only the hashing runs on the executor: a job still queued when
+        # hashing.run() times out must not create the user behind the 503
+        user = User(username=User.normalize_username(username))
+        user.password = hashing.run(make_password, password)
+        user.save()
+        logger.info("User '%s' registered successfully with ID: %s", username, user.id)
         return JsonResponse({'success': True})
         
+    except Overloaded as e:
+        logger.warning("Registration refused, hashing executor overloaded: %s", e)
+        return overloaded_response(success_flag=True)
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in register request: {e}")
+        logger.error("Invalid JSON in register request: %s", e)
         return JsonResponse({
             'success': False,
             'error': 'Invalid JSON'
         }, status=400)
     except Exception as e:
-        logger.error(f"Unexpected error in register: {e}")
+        logger.error("Unexpected error in register: %s", e)
         return JsonResponse({
             'success': False,
             'error': str(e)
@@ -96,6 +159,8 @@ def register(request):
         200: LoginResponseSerializer,
         400: ErrorResponseSerializer,
         401: ErrorResponseSerializer,
+        429: ErrorResponseSerializer,
+        503: ErrorResponseSerializer,
     },
     examples=[
         OpenApiExample(
@@ -111,44 +176,58 @@ def register(request):
 @api_view(['POST'])
 def login(request):
     logger.info("=== LOGIN REQUEST ===")
-    logger.info(f"Request method: {request.method}")
-    logger.info(f"Content-Type: {request.META.get('CONTENT_TYPE', 'N/A')}")
-    logger.info(f"Origin: {request.META.get('HTTP_ORIGIN', 'N/A')}")
+    logger.info("Request method: %s", request.method)
+    logger.info("Content-Type: %s", request.META.get('CONTENT_TYPE', 'N/A'))
+    logger.info("Origin: %s", request.META.get('HTTP_ORIGIN', 'N/A'))
     
     try:
         data = json.loads(request.body)
         username = data.get('username')
         password = data.get('password')
         
-        logger.info(f"Login attempt for username: {username}")
+        logger.info("Login attempt for username: %s", username)
         
         if not username or not password:
-            logger.warning(f"Missing credentials - username: {bool(username)}, password: {bool(password)}")
+            logger.warning("Missing credentials - username: %s, password: %s", bool(username), bool(password))
             return JsonResponse({'error': 'Username and password are required'}, status=400)
         
-        user = authenticate(username=username, password=password)
+        ip = client_ip(request)
+        for throttle, ident in ((login_ip_throttle, ip), (login_username_throttle, username)):
+            if throttle.is_blocked(ident):
+                logger.warning("Login throttled (%s) for username '%s' from IP %s", throttle.scope, username, ip)
+                return throttled_response(throttle.window)
+        login_ip_throttle.hit(ip)
+        
+        user = hashing.run(authenticate, username=username, password=password)
         if user:
+            login_username_throttle.reset(username)
             token = create_jwt_token(user)
-            logger.info(f"Login successful for user '{username}' (ID: {user.id})")
-            logger.debug(f"Generated JWT token: {token[:20]}...")
+            logger.info("Login successful for user '%s' (ID: %s)", username, user.id)
+            logger.debug("Generated JWT token: %s...", token[:20])
             return JsonResponse({'token': token})
         else:
-            logger.warning(f"Login failed for username '{username}' - invalid credentials")
+            login_username_throttle.hit(username)
+            logger.warning("Login failed for username '%s' - invalid credentials", username)
             return JsonResponse({'error': 'Invalid credentials'}, status=401)
             
+    except Overloaded as e:
+        logger.warning("Login refused, hashing executor overloaded: %s", e)
+        return overloaded_response()
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in login request: {e}")
+        logger.error("Invalid JSON in login request: %s", e)
         return JsonResponse({'error': 'Invalid JSON'}, status=400)
     except Exception as e:
-        logger.error(f"Unexpected error in login: {e}")
+        logger.error("Unexpected error in login: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
 @extend_schema(
     operation_id='list_users',
     summary='Liste des utilisateurs',
-    description='Récupérer la liste de tous les utilisateurs enregistrés.',
+    description='Récupérer les utilisateurs enregistrés, triés par nom, page par page. '
+                'Filtrer par nom avec q= ou récupérer des utilisateurs précis avec ids=.',
     responses={
         200: UsersResponseSerializer,
+        400: ErrorResponseSerializer,
         401: ErrorResponseSerializer,
     },
     parameters=[
@@ -158,7 +237,43 @@ def login(request):
             location=OpenApiParameter.HEADER,
             description='Token JWT d\'authentification',
             required=True
-        )
+        ),
+        OpenApiParameter(
+            name='limit',
+            type=int,
+            location=OpenApiParameter.QUERY,
+            description='Nombre maximum d\'utilisateurs retournés',
+            required=False
+        ),
+        OpenApiParameter(
+            name='after',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Curseur (next_cursor de la page précédente)',
+            required=False
+        ),
+        OpenApiParameter(
+            name='q',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Recherche sur le nom d\'utilisateur, insensible à la casse (préfixe par défaut)',
+            required=False
+        ),
+        OpenApiParameter(
+            name='match',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Mode de recherche de q : prefix (défaut) ou contains',
+            required=False,
+            enum=['prefix', 'contains']
+        ),
+        OpenApiParameter(
+            name='ids',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Liste d\'IDs séparés par des virgules (sans pagination)',
+            required=False
+        ),
     ],
     tags=['Utilisateurs']
 )
@@ -166,38 +281,88 @@ def login(request):
 @api_view(['GET'])
 def users(request):
     logger.info("=== USERS LIST REQUEST ===")
-    logger.info(f"Request from user: {request.user.username} (ID: {request.user.id})")
-    logger.info(f"Origin: {request.META.get('HTTP_ORIGIN', 'N/A')}")
+    logger.info("Request from user: %s (ID: %s)", request.user.username, request.user.id)
+    logger.info("Origin: %s", request.META.get('HTTP_ORIGIN', 'N/A'))
     
     try:
-        users_list = []
-        all_users = User.objects.all()
-        logger.info(f"Found {all_users.count()} users in database")
-        
-        for user in all_users:
-            users_list.append({
-                'id': user.id,
-                'username': user.username
-            })
-            logger.debug(f"Added user to list: {user.username} (ID: {user.id})")
-        
-        logger.info(f"Returning {len(users_list)} users to client")
-        return JsonResponse({'users': users_list})
+        queryset, limit = _users_query(request.GET)
+    except InvalidCursor:
+        logger.warning("Invalid users cursor: %s", request.GET.get('after'))
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        etag = _users_etag(request)
+        response = not_modified(request, etag)
+        if response is not None:
+            logger.info("Users not modified for user %s", request.user.id)
+            return response
+        return set_validators(JsonResponse(_users_page(list(queryset), limit)), etag)
     except Exception as e:
-        logger.error(f"Error retrieving users list: {e}")
+        logger.error("Error retrieving users list: %s", e)
         return JsonResponse({'error': str(e)}, status=500)
 
+def _users_query(params):
+    """Queryset of {id, username} rows for GET /users, plus the page size.
+
+    Ordered by username so `after` is a plain keyset on the unique username
+    index. `q` compiles to UPPER(username) LIKE, which the pg_trgm index
+    serves on PostgreSQL for prefix and substring matches alike.
+    """
+    queryset = User.objects.values('id', 'username').order_by('username')
+    
+    ids = params.get('ids')
+    if ids:
+        try:
+            id_list = [int(value) for value in ids.split(',') if value.strip()]
+        except ValueError:
+            raise ValueError(f"Invalid ids: {ids}")
+        if len(id_list) > settings.USERS_PAGE_MAX:
+            raise ValueError(f"At most {settings.USERS_PAGE_MAX} ids per request")
+        return queryset.filter(id__in=id_list), None
+    
+    limit = parse_limit(params.get('limit'), settings.USERS_PAGE_SIZE, settings.USERS_PAGE_MAX)
+    q = params.get('q', '').strip()
+    if q:
+        match = params.get('match') or 'prefix'
+        if match == 'prefix':
+            queryset = queryset.filter(username__istartswith=q)
+        elif match == 'contains':
+            queryset = queryset.filter(username__icontains=q)
+        else:
+            raise ValueError(f"Invalid match: {match}")
+    after = params.get('after')
+    if after:
+        queryset = queryset.filter(username__gt=decode_token(after))
+    return queryset[:limit + 1], limit
+
+def _users_page(rows, limit):
+    """Response body for GET /users from at most limit + 1 fetched rows"""
+    if limit is None:
+        return {'users': rows, 'has_more': False, 'next_cursor': None}
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    logger.info("Returning %s users (has_more=%s)", len(rows), has_more)
+    return {
+        'users': rows,
+        'has_more': has_more,
+        'next_cursor': encode_token(rows[-1]['username']) if has_more else None,
+    }
+
 @extend_schema(
     operation_id='handle_messages',
     summary='Gestion des messages',
-    description='Envoyer un nouveau message (POST) ou récupérer les messages (GET).',
+    description='Envoyer un nouveau message (POST) ou récupérer les messages (GET), paginés par curseur (before) ou en synchronisation incrémentale (since, à dédupliquer par id). with= limite la lecture à une conversation privée.',
     request={
-        'application/json': SendMessageSerializer
+        'application/json': SendMessageSerializer,
+        'multipart/form-data': SendMessageMultipartSerializer,
     },
     responses={
         200: MessagesResponseSerializer,
         400: ErrorResponseSerializer,
         401: ErrorResponseSerializer,
+        413: ErrorResponseSerializer,
     },
     parameters=[
         OpenApiParameter(
@@ -206,7 +371,38 @@ def users(request):
             location=OpenApiParameter.HEADER,
             description='Token JWT d\'authentification',
             required=True
-        )
+        ),
+        OpenApiParameter(
+            name='limit',
+            type=int,
+            location=OpenApiParameter.QUERY,
+            description='Nombre maximum de messages retournés (GET)',
+            required=False
+        ),
+        OpenApiParameter(
+            name='with',
+            type=int,
+            location=OpenApiParameter.QUERY,
+            description='ID d\'utilisateur : uniquement la conversation privée avec cet utilisateur (GET)',
+            required=False
+        ),
+        OpenApiParameter(
+            name='before',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='ID de message ou curseur : messages plus anciens (GET)',
+            required=False
+        ),
+        OpenApiParameter(
+            name='since',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='ID de message ou curseur : uniquement les messages plus récents (GET). '
+                        'Les curseurs renvoyés restent FEED_SETTLE_SECONDS (5 s) derrière le message le plus '
+                        'récent : un message déjà reçu peut être renvoyé au poll suivant, le client doit '
+                        'dédupliquer par id.',
+            required=False
+        ),
     ],
     examples=[
         OpenApiExample(
@@ -240,27 +436,55 @@ def users(request):
 @jwt_required
 @api_view(['GET', 'POST'])
 def messages_handler(request):
-    logger.info(f"=== MESSAGES REQUEST ({request.method}) ===")
-    logger.info(f"Request from user: {request.user.username} (ID: {request.user.id})")
-    logger.info(f"Origin: {request.META.get('HTTP_ORIGIN', 'N/A')}")
+    logger.info("=== MESSAGES REQUEST (%s) ===", request.method)
+    logger.info("Request from user: %s (ID: %s)", request.user.username, request.user.id)
+    logger.info("Origin: %s", request.META.get('HTTP_ORIGIN', 'N/A'))
     
     if request.method == 'POST':
         return send_message(request)
     elif request.method == 'GET':
         return get_messages(request)
 
+def decode_image(image_data):
+    """Build a ContentFile from the JSON `image` object, None when absent.
+    Raises ValueError on undecodable base64."""
+    if not image_data or not isinstance(image_data, dict):
+        return None
+    image_name = image_data.get('name')
+    image_content = image_data.get('content')
+    if not image_name or not image_content:
+        return None
+    
+    logger.info("Processing image: %s (%s chars base64)", image_name, len(image_content))
+    try:
+        data = base64.b64decode(image_content)
+    except (TypeError, binascii.Error) as e:
+        raise ValueError(str(e))
+    if not data:
+        # b64decode() skips characters outside the alphabet: '!!' decodes to nothing
+        raise ValueError('Empty image')
+    return ContentFile(data, name=image_name)
+
 def send_message(request):
     logger.info("--- SEND MESSAGE ---")
     
     try:
-        data = json.loads(request.body)
-        content = data.get('content')
-        to_user_id = data.get('to')
-        image_data = data.get('image')
+        if request.content_type.startswith('multipart/form-data'):
+            # Streaming variant: the file part goes straight to a temporary
+            # file and is moved into storage on save.
+            content, to_user_id, image_file = read_multipart_message(request._request)
+            image_data = None
+        else:
+            data = json.loads(request.body)
+            content = data.get('content')
+            to_user_id = data.get('to')
+            image_data = data.get('image')
+            image_file = None
         
-        logger.info(f"Message content: {content[:50]}..." if len(content) > 50 else f"Message content: {content}")
-        logger.info(f"Target user ID: {to_user_id}")
-        logger.info(f"Has image: {bool(image_data)}")
+        content_preview = content if not content or len(content) <= 50 else f"{content[:50]}..."
+        logger.info("Message content: %s", content_preview)
+        logger.info("Target user ID: %s", to_user_id)
+        logger.info("Has image: %s", bool(image_data or image_file))
         
         if not content:
             logger.warning("Message rejected - empty content")
@@ -280,101 +504,704 @@ def send_message(request):
                 to_user = User.objects.get(id=to_user_id)
                 message.to_user = to_user
                 message_type = f"private to {to_user.username}"
-                logger.info(f"Private message target: {to_user.username} (ID: {to_user.id})")
+                logger.info("Private message target: %s (ID: %s)", to_user.username, to_user.id)
             except User.DoesNotExist:
-                logger.warning(f"Recipient user not found: ID {to_user_id}")
+                logger.warning("Recipient user not found: ID %s", to_user_id)
                 return JsonResponse({
                     'success': False,
                     'error': 'Recipient user not found'
                 }, status=400)
         
-        if image_data and isinstance(image_data, dict):
-            image_name = image_data.get('name')
-            image_content = image_data.get('content')
-            
-            if image_name and image_content:
-                try:
-                    logger.info(f"Processing image: {image_name} ({len(image_content)} chars base64)")
-                    image_file = ContentFile(
-                        base64.b64decode(image_content),
-                        name=image_name
-                    )
-                    message.image = image_file
-                    logger.info("Image processed successfully")
-                except Exception as e:
-                    logger.error(f"Image processing failed: {e}")
-                    return JsonResponse({
-                        'success': False,
-                        'error': 'Invalid image data'
-                    }, status=400)
+        try:
+            image_file = image_file or decode_image(image_data)
+        except ValueError as e:
+            logger.error("Image processing failed: %s", e)
+            return JsonResponse({
+                'success': False,
+                'error': 'Invalid image data'
+            }, status=400)
+        if image_file:
+            message.image = image_file
+            logger.info("Image processed successfully")
         
         message.save()
-        logger.info(f"Message saved successfully - ID: {message.id}, Type: {message_type}")
+        logger.info("Message saved successfully - ID: %s, Type: %s", message.id, message_type)
         return JsonResponse({'success': True})
         
+    except UploadTooLarge as e:
+        logger.warning("Upload rejected - %s bytes exceeds %s", e, settings.MESSAGE_UPLOAD_MAX_BYTES)
+        return upload_too_large_response()
     except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in send message: {e}")
+        logger.error("Invalid JSON in send message: %s", e)
         return JsonResponse({
             'success': False,
             'error': 'Invalid JSON'
         }, status=400)
     except Exception as e:
-        logger.error(f"Unexpected error in send message: {e}")
+        logger.error("Unexpected error in send message: %s", e)
         return JsonResponse({
             'success': False,
             'error': str(e)
         }, status=500)
 
-def get_messages(request):
-    logger.info("--- GET MESSAGES ---")
+@extend_schema(
+    operation_id='send_message_batch',
+    summary='Envoi groupé de messages',
+    description='Envoyer jusqu\'à MESSAGE_BATCH_MAX messages en une requête. Les destinataires sont résolus '
+                'en une seule requête et les messages insérés en une transaction ; chaque message est accepté '
+                'ou refusé individuellement (results, dans l\'ordre de la requête). Si aucun message n\'est '
+                'accepté, la réponse est un 400 avec le même détail results.',
+    request=SendMessageBatchSerializer,
+    responses={
+        200: MessageBatchResponseSerializer,
+        400: ErrorResponseSerializer,
+        401: ErrorResponseSerializer,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='x-api-key',
+            type=str,
+            location=OpenApiParameter.HEADER,
+            description='Token JWT d\'authentification',
+            required=True
+        ),
+    ],
+    examples=[
+        OpenApiExample(
+            'Envoi groupé',
+            description='Un message public et un message privé',
+            value={'messages': [{'content': 'Bonjour à tous'}, {'content': 'Salut', 'to': 2}]},
+            request_only=True,
+        ),
+        OpenApiExample(
+            'Résultat partiel',
+            description='Le second message est refusé, le premier est enregistré',
+            value={
+                'success': True,
+                'created': 1,
+                'results': [
+                    {'index': 0, 'success': True, 'id': 41},
+                    {'index': 1, 'success': False, 'error': 'Recipient user not found'},
+                ],
+            },
+            response_only=True,
+        ),
+        OpenApiExample(
+            'Aucun message accepté',
+            description='Tous les messages sont refusés : rien n\'est enregistré',
+            value={
+                'success': False,
+                'error': 'No message accepted',
+                'created': 0,
+                'results': [{'index': 0, 'success': False, 'error': 'Content is required'}],
+            },
+            response_only=True,
+            status_codes=['400'],
+        ),
+    ],
+    tags=['Messages']
+)
+@csrf_exempt
+@jwt_required
+@api_view(['POST'])
+def send_message_batch(request):
+    logger.info("--- SEND MESSAGE BATCH from user %s ---", request.user.id)
     
     try:
-        messages = Message.objects.filter(
-            models.Q(from_user=request.user) |
-            models.Q(to_user=request.user) |
-            models.Q(to_user__isnull=True)
-        ).order_by('-created_at')
-        
-        logger.info(f"Found {messages.count()} messages for user {request.user.username}")
+        data = json.loads(request.body)
+    except json.JSONDecodeError as e:
+        logger.error("Invalid JSON in message batch: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': 'Invalid JSON'
+        }, status=400)
+    
+    items = data.get('messages') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        return JsonResponse({
+            'success': False,
+            'error': 'messages must be a non-empty array'
+        }, status=400)
+    if len(items) > settings.MESSAGE_BATCH_MAX:
+        return JsonResponse({
+            'success': False,
+            'error': f'At most {settings.MESSAGE_BATCH_MAX} messages per batch'
+        }, status=400)
+    
+    try:
+        # Every recipient of the batch in one query
+        wanted = {_recipient_id(item.get('to')) for item in items if isinstance(item, dict) and item.get('to')}
+        wanted.discard(None)
+        recipients = set(User.objects.filter(id__in=wanted).values_list('id', flat=True)) if wanted else set()
         
-        messages_list = []
-        public_count = 0
-        private_count = 0
+        results = []
+        accepted = []
+        for index, item in enumerate(items):
+            message, error = _batch_message(item, request.user, recipients)
+            if error:
+                results.append({'index': index, 'success': False, 'error': error})
+            else:
+                accepted.append((index, message))
         
+        messages = [message for _, message in accepted]
         for message in messages:
-            message_data = {
-                'content': message.content,
-                'from': {
-                    'id': message.from_user.id,
-                    'username': message.from_user.username
-                }
-            }
-            
-            if message.image:
-                # Build the correct HTTPS URL for external access
-                # Always use the external IP and HTTPS port for frontend compatibility
-                external_ip = "10.111.46.149"  # Known external IP
-                image_url = f"https://{external_ip}:8443{message.image.url}"
-                
-                message_data['image'] = image_url
-                logger.debug(f"Message {message.id} has image: {message.image.name} -> {image_url}")
-            
-            if message.to_user:
-                message_data['to'] = {
-                    'id': message.to_user.id,
-                    'username': message.to_user.username
-                }
-                private_count += 1
-                logger.debug(f"Private message {message.id}: {message.from_user.username} -> {message.to_user.username}")
-            else:
-                public_count += 1
-                logger.debug(f"Public message {message.id} from {message.from_user.username}")
-            
-            messages_list.append(message_data)
+            message.assign_conversation()
+        if messages:
+            with transaction.atomic():
+                Message.objects.bulk_create(messages)
+                messages_bulk_created(messages)
+        results.extend({'index': index, 'success': True, 'id': message.id} for index, message in accepted)
+        results.sort(key=lambda result: result['index'])
         
-        logger.info(f"Returning {len(messages_list)} messages ({public_count} public, {private_count} private)")
-        return JsonResponse({'messages': messages_list})
+        if not messages:
+            # Nothing saved: a client error, with the reason of each refusal
+            logger.warning("Message batch refused: %s invalid messages", len(items))
+            return JsonResponse({
+                'success': False,
+                'error': 'No message accepted',
+                'created': 0,
+                'results': results
+            }, status=400)
+        
+        logger.info("Message batch saved: %s created, %s refused", len(messages), len(items) - len(messages))
+        return JsonResponse({'success': True, 'created': len(messages), 'results': results})
+    
+    except Exception as e:
+        logger.error("Unexpected error in message batch: %s", e)
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        }, status=500)
+
+def _recipient_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def _batch_message(item, sender, recipients):
+    """Unsaved Message for one batch item, or the reason it is refused"""
+    if not isinstance(item, dict):
+        return None, 'Invalid message'
+    content = item.get('content')
+    if not content or not isinstance(content, str):
+        return None, 'Content is required'
+    
+    message = Message(content=content, from_user=sender)
+    if item.get('to'):
+        to_user_id = _recipient_id(item['to'])
+        if to_user_id not in recipients:
+            return None, 'Recipient user not found'
+        message.to_user_id = to_user_id
+    
+    try:
+        image_file = decode_image(item.get('image'))
+    except ValueError:
+        return None, 'Invalid image data'
+    if image_file:
+        message.image = image_file
+    return message, None
+
+def _resolve_position(value):
+    """Turn a `before`/`since` parameter (opaque cursor or message id) into a
+    (created_at, id) keyset position."""
+    if value.isdigit():
+        created_at = Message.objects.filter(pk=int(value)).values_list('created_at', flat=True).first()
+        if created_at is None:
+            created_at = ArchivedMessage.objects.filter(pk=int(value)).values_list('created_at', flat=True).first()
+        if created_at is None:
+            raise InvalidCursor(value)
+        return created_at, int(value)
+    return decode_cursor(value)
+
+FEED_FIELDS = (
+    'id', 'content', 'image', 'image_variants', 'created_at',
+    'from_user_id', 'from_user__username',
+    'to_user_id', 'to_user__username',
+)
+FEED_CHUNK_SIZE = 100
+
+def _visible_messages(user, position=None, direction='before', limit=None, fields=FEED_FIELDS, public=True, model=Message):
+    """Messages visible to `user` (public, sent or received), ordered along
+    `direction` and limited to `limit` rows. With public=False only the
+    user's private messages (sent or received) are returned; with
+    model=ArchivedMessage the archived ones.
+
+    Each visibility branch is queried separately so it can walk its own
+    index (public partial index, from_user or to_user composite) and stop
+    after `limit` rows; the UNION then merges at most 3 * limit rows instead
+    of sorting every visible message. Rows are dicts of `fields`, usernames
+    included, so serializing them needs no further queries.
+    """
+    order = ('created_at', 'id') if direction == 'since' else ('-created_at', '-id')
+    sent = model.objects.filter(from_user=user)
+    if not public:
+        sent = sent.filter(to_user__isnull=False)
+    branches = [sent.values(*fields), model.objects.filter(to_user=user).values(*fields)]
+    if public:
+        branches.insert(0, model.objects.filter(to_user__isnull=True).values(*fields))
+    if position is not None:
+        branches = [keyset_filter(branch, position, direction) for branch in branches]
+
+    if not connections[model.objects.db].features.supports_slicing_ordering_in_compound:
+        # e.g. SQLite: no ORDER BY/LIMIT inside compound members, keep the OR
+        if public:
+            condition = models.Q(from_user=user) | models.Q(to_user=user) | models.Q(to_user__isnull=True)
+        else:
+            condition = models.Q(from_user=user, to_user__isnull=False) | models.Q(to_user=user)
+        messages = model.objects.filter(condition).values(*fields)
+        if position is not None:
+            messages = keyset_filter(messages, position, direction)
+        return messages.order_by(*order)[:limit]
+
+    branches = [branch.order_by(*order)[:limit] for branch in branches]
+    return branches[0].union(*branches[1:]).order_by(*order)[:limit]
+
+def get_messages(request):
+    logger.info("--- GET MESSAGES ---")
+    
+    before = request.GET.get('before')
+    since = request.GET.get('since')
+    if before and since:
+        return JsonResponse({'error': 'Use either before or since, not both'}, status=400)
+    peer = request.GET.get('with')
+    if peer is not None and not peer.isdigit():
+        return JsonResponse({'error': f'Invalid user id: {peer}'}, status=400)
+    
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+        position = _resolve_position(before or since) if (before or since) else None
+    except InvalidCursor:
+        logger.warning("Invalid cursor: %s", before or since)
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        peer_id = int(peer) if peer is not None else None
+        if peer_id is not None:
+            thread = _conversation(request.user, peer_id)
+            newest = _thread_head(thread)
+        else:
+            heads = _feed_heads(request.user)
+            newest = _newest(heads)
+        etag = feed_etag(request, newest)
+        response = not_modified(request, etag)
+        if response is not None:
+            logger.info("Messages not modified for user %s", request.user.id)
+            return response
         
+        direction = 'since' if since else 'before'
+        boundary = _archive_boundary()
+        if _in_archive_window(position, boundary):
+            rows = _archive_window_rows(request.user, peer_id, position, direction, limit + 1)
+        else:
+            if peer_id is not None:
+                rows = _thread_messages(thread, position, direction, limit + 1).iterator(chunk_size=FEED_CHUNK_SIZE)
+            else:
+                public_rows = public_timeline.page(heads['public'], position, direction, limit + 1)
+                if public_rows is None:
+                    rows = _visible_messages(request.user, position, direction, limit + 1).iterator(chunk_size=FEED_CHUNK_SIZE)
+                else:
+                    # Public messages come pre-serialized from the buffer; only the
+                    # user's private messages are read from the database.
+                    private_rows = _visible_messages(request.user, position, direction, limit + 1, public=False)
+                    rows = _merge_feed(public_rows, private_rows.iterator(chunk_size=FEED_CHUNK_SIZE), direction, limit + 1)
+            if boundary is not None and direction == 'before':
+                rows = _fall_through(rows, request.user, peer_id, position, limit + 1, boundary)
+        # Run the query now so database errors still produce a JSON 500
+        # instead of a truncated stream.
+        first_row = next(rows, None)
     except Exception as e:
-        logger.error(f"Error retrieving messages: {e}")
-        return JsonResponse({'error': str(e)}, status=500)
\ No newline at end of file
+        logger.error("Error retrieving messages: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    if first_row is not None:
+        rows = itertools.chain([first_row], rows)
+    else:
+        rows = iter(())
+    stream = _stream_feed(rows, limit, direction, position, first_page=not (before or since))
+    return set_validators(StreamingHttpResponse(stream, content_type='application/json'), etag)
+
+def _conversation(user, peer_id, model=Message):
+    """Private messages between `user` and user `peer_id`, in both directions"""
+    low, high = sorted((user.id, peer_id))
+    return model.objects.filter(conv_low=low, conv_high=high)
+
+def _thread_head(thread):
+    return thread.values('id', 'created_at').order_by('-created_at', '-id').first()
+
+def _thread_messages(thread, position=None, direction='before', limit=None):
+    """One conversation in feed order: a single range scan of
+    message_conversation_idx, stopping after `limit` rows"""
+    order = ('created_at', 'id') if direction == 'since' else ('-created_at', '-id')
+    rows = thread.values(*FEED_FIELDS)
+    if position is not None:
+        rows = keyset_filter(rows, position, direction)
+    return rows.order_by(*order)[:limit]
+
+def _archive_boundary():
+    """created_at before which a message may have been archived (None when
+    archiving is disabled). archive_messages never moves anything newer."""
+    if not settings.ARCHIVE_AFTER_DAYS:
+        return None
+    return timezone.now() - timedelta(days=settings.ARCHIVE_AFTER_DAYS)
+
+def _in_archive_window(position, boundary):
+    return boundary is not None and position is not None and position[0] < boundary
+
+def _archive_window_rows(user, peer_id, position, direction, count):
+    """Feed rows past the archive boundary: rows still in chat_message (not
+    archived yet) merged with archived ones, both read from their indexes."""
+    if peer_id is None:
+        hot = _visible_messages(user, position, direction, count)
+        archived = _visible_messages(user, position, direction, count, model=ArchivedMessage)
+    else:
+        hot = _thread_messages(_conversation(user, peer_id), position, direction, count)
+        archived = _thread_messages(_conversation(user, peer_id, ArchivedMessage), position, direction, count)
+    return _merge_feed(
+        hot.iterator(chunk_size=FEED_CHUNK_SIZE), archived.iterator(chunk_size=FEED_CHUNK_SIZE), direction, count,
+    )
+
+def _fall_through(rows, user, peer_id, position, count, boundary):
+    """Older-first page that starts in the hot window: its rows down to the
+    boundary, then the archive window from the last one. The archive is
+    only read when the page reaches that far."""
+    emitted = 0
+    last = position
+    for row in rows:
+        if row['created_at'] < boundary:
+            break
+        yield row
+        emitted += 1
+        last = (row['created_at'], row['id'])
+    if emitted < count:
+        yield from _archive_window_rows(user, peer_id, last, 'before', count - emitted)
+
+def _feed_heads(user):
+    """Newest {'id', 'created_at'} of each visibility branch (None if empty),
+    read in one query from the same indexes as the feed: the ETag comes from
+    the newest of them and the public one keeps the timeline buffer coherent."""
+    branches = {
+        'public': Message.objects.filter(to_user__isnull=True),
+        'sent': Message.objects.filter(from_user=user),
+        'received': Message.objects.filter(to_user=user),
+    }
+    heads = dict.fromkeys(branches)
+    queries = [
+        queryset.annotate(branch=models.Value(name, output_field=models.CharField()))
+        .values('id', 'created_at', 'branch').order_by('-created_at', '-id')[:1]
+        for name, queryset in branches.items()
+    ]
+    if connections[Message.objects.db].features.supports_slicing_ordering_in_compound:
+        rows = queries[0].union(*queries[1:], all=True)
+    else:
+        rows = itertools.chain.from_iterable(queries)
+    for row in rows:
+        heads[row.pop('branch')] = row
+    return heads
+
+def _newest(heads):
+    rows = [row for row in heads.values() if row is not None]
+    return max(rows, key=lambda row: (row['created_at'], row['id'])) if rows else None
+
+def _merge_feed(public_rows, private_rows, direction, count):
+    """Merge buffered public rows with private rows from the database (or
+    hot rows with archived ones), both already in feed order, keeping the
+    first `count`."""
+    merged = heapq.merge(
+        public_rows, private_rows,
+        key=lambda row: (row['created_at'], row['id']),
+        reverse=direction == 'before',
+    )
+    return itertools.islice(merged, count)
+
+def _users_etag(request):
+    newest = User.objects.values('id', 'date_joined').order_by('-id').first()
+    return users_etag(request, newest)
+
+def _serialize_feed_row(row):
+    message_data = {
+        'id': row['id'],
+        'content': row['content'],
+        'from': {
+            'id': row['from_user_id'],
+            'username': row['from_user__username']
+        },
+        'created_at': row['created_at'].isoformat()
+    }
+    
+    if row['image']:
+        # Served through message_image, which checks access; private
+        # images get short-lived signed URLs (MEDIA_BASE_URL is the
+        # externally reachable HTTPS origin).
+        private = row['to_user_id'] is not None
+        message_data['image'] = image_url(row['id'], private=private)
+        variants = row['image_variants'] or {}
+        if variants:
+            message_data['variants'] = {
+                name: image_url(row['id'], name, private)
+                for name in variants
+            }
+            thumbnail = 'thumb_webp' if 'thumb_webp' in variants else 'thumb'
+            if thumbnail in variants:
+                message_data['thumbnail'] = message_data['variants'][thumbnail]
+    
+    if row['to_user_id'] is not None:
+        message_data['to'] = {
+            'id': row['to_user_id'],
+            'username': row['to_user__username']
+        }
+    return message_data
+
+def _stream_feed(rows, limit, direction, position, first_page):
+    """Encode the feed one message at a time so the worker never holds more
+    than a database fetch chunk and one encoded message in memory.
+
+    The delta cursors (next_cursor of ?since=, sync_cursor) point at the
+    newest message older than FEED_SETTLE_SECONDS: a message still being
+    committed behind a newer one is picked up by the next poll, and the
+    newer ones are sent again.
+    """
+    yield b'{"messages": ['
+    count = public_count = 0
+    first = last = settled = None
+    has_more = False
+    settled_before = timezone.now() - timedelta(seconds=settings.FEED_SETTLE_SECONDS)
+    for row in rows:
+        if count == limit:
+            has_more = True
+            break
+        if first is None:
+            first = row
+        last = row
+        # Ascending (since): the newest settled row is the last one seen;
+        # descending: the first one
+        if row['created_at'] <= settled_before and (direction == 'since' or settled is None):
+            settled = row
+        if row['to_user_id'] is None:
+            public_count += 1
+        encoded = row.get('_json') or json.dumps(_serialize_feed_row(row)).encode('utf-8')
+        yield (b', ' if count else b'') + encoded
+        count += 1
+    
+    trailer = {'has_more': has_more}
+    if direction == 'since':
+        # Delta mode: the client keeps polling with the cursor. A page with
+        # nothing settled yet but more to come still moves it forward.
+        head = settled or (last if has_more else None)
+        trailer['next_cursor'] = encode_cursor(head['created_at'], head['id']) if head else encode_cursor(*position)
+    else:
+        trailer['next_cursor'] = encode_cursor(last['created_at'], last['id']) if has_more else None
+        if first_page:
+            head = settled or last
+            trailer['sync_cursor'] = encode_cursor(head['created_at'], head['id']) if head else None
+    yield b'], ' + json.dumps(trailer)[1:].encode('utf-8')
+    
+    logger.info("Streamed %s messages (%s public, %s private, has_more=%s)", count, public_count, count - public_count, has_more)
+
+@extend_schema(
+    operation_id='search_messages',
+    summary='Recherche dans les messages',
+    description='Rechercher les messages accessibles à l\'utilisateur (publics, envoyés, reçus) contenant tous les '
+                'mots de q, du plus pertinent au moins pertinent. Index plein texte : tsvector + GIN sous '
+                'PostgreSQL, FTS5 sous SQLite.',
+    responses={
+        200: MessageSearchResponseSerializer,
+        400: ErrorResponseSerializer,
+        401: ErrorResponseSerializer,
+    },
+    parameters=[
+        OpenApiParameter(
+            name='x-api-key',
+            type=str,
+            location=OpenApiParameter.HEADER,
+            description='Token JWT d\'authentification',
+            required=True
+        ),
+        OpenApiParameter(
+            name='q',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Mots recherchés (tous doivent apparaître, insensible à la casse)',
+            required=True
+        ),
+        OpenApiParameter(
+            name='limit',
+            type=int,
+            location=OpenApiParameter.QUERY,
+            description='Nombre maximum de résultats retournés',
+            required=False
+        ),
+        OpenApiParameter(
+            name='after',
+            type=str,
+            location=OpenApiParameter.QUERY,
+            description='Curseur (next_cursor de la page précédente)',
+            required=False
+        ),
+    ],
+    tags=['Messages']
+)
+@csrf_exempt
+@jwt_required
+@api_view(['GET'])
+def message_search(request):
+    logger.info("--- SEARCH MESSAGES from user %s ---", request.user.id)
+    
+    after = request.GET.get('after')
+    try:
+        terms = search_terms(request.GET.get('q', ''))
+        limit = parse_limit(request.GET.get('limit'))
+        position = decode_search_cursor(after) if after else None
+    except InvalidCursor:
+        logger.warning("Invalid search cursor: %s", after)
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    try:
+        hits = search_messages(request.user, terms, position, limit + 1)
+        has_more = len(hits) > limit
+        hits = hits[:limit]
+        rows = {row['id']: row for row in Message.objects.filter(id__in=[pk for pk, _ in hits]).values(*FEED_FIELDS)}
+        results = []
+        for pk, score in hits:
+            # Deleted between the two queries
+            if pk in rows:
+                results.append(dict(_serialize_feed_row(rows[pk]), score=score))
+    except Exception as e:
+        logger.error("Error searching messages: %s", e)
+        return JsonResponse({'error': str(e)}, status=500)
+    
+    logger.info("Search %s: %s results (has_more=%s)", terms, len(results), has_more)
+    return JsonResponse({
+        'messages': results,
+        'has_more': has_more,
+        'next_cursor': encode_search_cursor(hits[-1][1], hits[-1][0]) if has_more else None,
+    })
+
+@csrf_exempt
+@require_GET
+@jwt_required
+def message_stream(request):
+    """Server-Sent Events: push every new message visible to the user.
+
+    Not wrapped in api_view: DRF content negotiation would reject
+    `Accept: text/event-stream`. Each stream holds a worker thread, so at
+    most SSE_MAX_STREAMS are open per process; the ASGI view has no cap.
+    """
+    logger.info("=== MESSAGE STREAM for user %s (ID: %s) ===", request.user.username, request.user.id)
+    
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    position = None
+    if last_event_id:
+        try:
+            position = _resolve_position(last_event_id)
+        except InvalidCursor:
+            logger.warning("Unknown Last-Event-ID %s, not replaying", last_event_id)
+    
+    # Subscribe before replaying so nothing committed in between is missed
+    subscriber = hub.subscribe(request.user.id, limit=settings.SSE_MAX_STREAMS)
+    if subscriber is None:
+        logger.warning("SSE stream refused for user %s, %s streams open", request.user.id, settings.SSE_MAX_STREAMS)
+        response = overloaded_response()
+        response['Retry-After'] = str(max(settings.SSE_RETRY_MS // 1000, 1))
+        return response
+    response = StreamingHttpResponse(
+        _event_stream(request.user, subscriber, position),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def _event_stream(user, subscriber, position):
+    heartbeat = settings.SSE_HEARTBEAT_SECONDS
+    deadline = time.monotonic() + settings.SSE_MAX_SECONDS
+    # Events can arrive out of id order (commit order differs from id
+    # order): only the ones already sent on this stream are skipped
+    sent = RecentIds(settings.SSE_SENT_IDS)
+    try:
+        yield f"retry: {settings.SSE_RETRY_MS}\n\n".encode('utf-8')
+        
+        if position is not None:
+            # Messages after the last event received, including those
+            # created shortly before it but committed after it
+            since = (position[0] - timedelta(seconds=settings.FEED_SETTLE_SECONDS), 0)
+            replay = _visible_messages(user, since, 'since', settings.SSE_REPLAY_LIMIT)
+            for row in replay:
+                if row['id'] > position[1] and sent.add(row['id']):
+                    yield format_event(row['id'], json.dumps(_serialize_feed_row(row)))
+        # Do not hold a database connection while idling on the queue
+        connection.close()
+        
+        while not subscriber.closed and time.monotonic() < deadline:
+            try:
+                event_id, data = subscriber.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield b": keepalive\n\n"
+                continue
+            if sent.add(event_id):
+                yield format_event(event_id, data)
+    finally:
+        hub.unsubscribe(subscriber)
+
+@csrf_exempt
+@require_safe
+def message_image(request, message_id):
+    """Authorize an image download and let nginx send the bytes.
+
+    Public images need no credentials. Private ones need either a valid
+    signature from the feed URL or the x-api-key of the sender or the
+    recipient. The response has no body, only X-Accel-Redirect to the
+    internal MEDIA_ACCEL_PREFIX location.
+    """
+    variant = request.GET.get('variant') or ''
+    row = (
+        Message.objects.filter(pk=message_id)
+        .values('from_user_id', 'to_user_id', 'image', 'image_variants')
+        .first()
+    ) or (
+        ArchivedMessage.objects.filter(pk=message_id)
+        .values('from_user_id', 'to_user_id', 'image', 'image_variants')
+        .first()
+    )
+    if row is None or not row['image']:
+        return JsonResponse({'error': 'Image not found'}, status=404)
+    name = (row['image_variants'] or {}).get(variant) if variant else row['image']
+    if not name:
+        return JsonResponse({'error': 'Image variant not found'}, status=404)
+    
+    if row['to_user_id'] is None:
+        cache_control = 'public, max-age=31536000, immutable'
+    elif verify_signature(message_id, variant, request.GET.get('expires'), request.GET.get('sig')):
+        remaining = max(int(request.GET['expires']) - int(time.time()), 0)
+        cache_control = f'private, max-age={remaining}'
+    else:
+        user, error = authenticate_request(request)
+        if error:
+            if request.GET.get('sig'):
+                logger.warning("Invalid or expired image signature for message %s", message_id)
+                return JsonResponse({'error': 'Invalid or expired signature'}, status=403)
+            return error
+        if user.id not in (row['from_user_id'], row['to_user_id']):
+            # Same answer as a missing image: do not reveal private messages
+            logger.warning("User %s denied image of private message %s", user.id, message_id)
+            return JsonResponse({'error': 'Image not found'}, status=404)
+        cache_control = 'private, no-cache'
+    
+    response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+    response['X-Accel-Redirect'] = accel_redirect_path(name)
+    response['Cache-Control'] = cache_control
+    return response
+
+@require_GET
+def metrics(request):
+    """Prometheus exposition of the request metrics of all workers"""
+    if settings.METRICS_TOKEN:
+        expected = f"Bearer {settings.METRICS_TOKEN}"
+        if not constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''), expected):
+            return JsonResponse({'error': 'Invalid metrics token'}, status=401)
+    body, content_type = render_metrics()
+    return HttpResponse(body, content_type=content_type)
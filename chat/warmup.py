@@ -0,0 +1,88 @@
+"""Boot-time warmup, run by gunicorn.conf.py in the master before it forks.
+
+With preload_app the master has already imported the project; warm_up()
+does the rest of what the first requests of every worker used to pay for
+(URLconf and views, DRF and drf-spectacular internals, password hashers,
+the public timeline buffer), so the workers inherit it copy-on-write and
+serve their first request like any other. It refuses to start on a database
+with unapplied migrations: they are applied by `manage.py migrate` before
+the deploy, never at boot.
+"""
+import logging
+import time
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+logger = logging.getLogger('chat.warmup')
+
+
+class PendingMigrations(RuntimeError):
+    """The database schema is behind the code"""
+
+
+def pending_migrations(alias=DEFAULT_DB_ALIAS):
+    """Migrations not applied to `alias`, like `manage.py migrate --check`"""
+    executor = MigrationExecutor(connections[alias])
+    plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+    return [f"{migration.app_label}.{migration.name}" for migration, _ in plan]
+
+
+def warm_up():
+    """Run every warmup step; {step: seconds}. Raises PendingMigrations."""
+    timings = {}
+
+    def step(name, func):
+        start = time.perf_counter()
+        func()
+        timings[name] = time.perf_counter() - start
+
+    # The master only needs a few short-lived connections: none from the
+    # pool (chat.pool), whose connections the workers would inherit
+    for connection in connections.all():
+        connection.pooled = False
+    try:
+        step('migrations', _check_migrations)
+        step('urls', _load_urls)
+        step('schema', _build_schema)
+        step('hashers', _load_hashers)
+        step('timeline', _load_timeline)
+    finally:
+        # Nothing opened here may be shared with the workers
+        for connection in connections.all():
+            connection.close()
+            del connection.pooled
+    logger.info("Warmed up in %.2fs (%s)", sum(timings.values()),
+                ', '.join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return timings
+
+
+def _check_migrations():
+    pending = pending_migrations()
+    if pending:
+        raise PendingMigrations(
+            f"{len(pending)} unapplied migrations ({', '.join(pending)}): run `python manage.py migrate` first"
+        )
+
+
+def _load_urls():
+    from django.urls import get_resolver, resolve
+    # Imports the URLconf with every view module, then builds the lookup tables
+    get_resolver().url_patterns
+    resolve('/messages')
+
+
+def _build_schema():
+    # The first /api/schema/ otherwise imports and introspects all of
+    # drf-spectacular and the serializers
+    from drf_spectacular.generators import SchemaGenerator
+    SchemaGenerator().get_schema(request=None, public=True)
+
+
+def _load_hashers():
+    from django.contrib.auth.hashers import get_hashers
+    get_hashers()
+
+
+def _load_timeline():
+    from .timeline import public_timeline
+    public_timeline.warm()
@@ -0,0 +1,14 @@
+import os
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatbot_api.settings')
+# Serve the async versions of the chat views under ASGI
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+
+application = get_asgi_application()
+
+from django.conf import settings  # noqa: E402
+from chat.uploads import BodySizeLimit  # noqa: E402
+
+# Refuse oversized bodies before Django spools them (see chat.uploads)
+application = BodySizeLimit(application, settings.MESSAGE_UPLOAD_MAX_BYTES)
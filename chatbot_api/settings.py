@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -30,6 +30,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'chat.middleware.MetricsMiddleware',
+    'chat.middleware.ProfilingMiddleware',
+    'chat.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     # 'corsheaders.middleware.CorsMiddleware',  # Disabled - nginx handles CORS
     'chat.middleware.RequestLoggingMiddleware',
@@ -60,17 +63,95 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'chatbot_api.wsgi.application'
+ASGI_APPLICATION = 'chatbot_api.asgi.application'
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql',
-        'NAME': config('DB_NAME', default='chatbot'),
-        'USER': config('DB_USER', default='postgres'),
-        'PASSWORD': config('DB_PASSWORD', default='postgres'),
-        'HOST': config('DB_HOST', default='db'),
-        'PORT': config('DB_PORT', default='5432'),
-    }
+# Use the async chat views (set automatically by chatbot_api.asgi)
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+# Thread pool for blocking work in async views (image decoding)
+ASYNC_BLOCKING_THREADS = config('ASYNC_BLOCKING_THREADS', default=4, cast=int)
+
+# DB_ENGINE=sqlite runs on a local file (DB_NAME, default db.sqlite3), e.g.
+# for benchmarks/load.py without a PostgreSQL server
+DB_ENGINE = config('DB_ENGINE', default='postgresql')
+# PostgreSQL connection pool (chat.pool), per worker process and alias:
+# MAX_SIZE should cover the gunicorn --threads plus the background threads
+# that query (password hashing, image variants); the SSE listener has its
+# own connection
+DB_POOL = config('DB_POOL', default=True, cast=bool)
+DB_POOL_OPTIONS = {
+    'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+    'max_size': config('DB_POOL_MAX_SIZE', default=20, cast=int),
+    # Seconds a request waits for a free connection before failing
+    'timeout': config('DB_POOL_TIMEOUT', default=5.0, cast=float),
+    # Connections are replaced after this long, closed when idle this long
+    # (above MIN_SIZE) and checked with SELECT 1 when idle this long
+    'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800.0, cast=float),
+    'max_idle': config('DB_POOL_MAX_IDLE', default=300.0, cast=float),
+    'ping_after': config('DB_POOL_PING_AFTER', default=1.0, cast=float),
 }
+if DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': config('DB_NAME', default=str(BASE_DIR / 'db.sqlite3')),
+        }
+    }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'chat.backends.postgresql_pool' if DB_POOL else 'django.db.backends.postgresql',
+            'NAME': config('DB_NAME', default='chatbot'),
+            'USER': config('DB_USER', default='postgres'),
+            'PASSWORD': config('DB_PASSWORD', default='postgres'),
+            'HOST': config('DB_HOST', default='db'),
+            'PORT': config('DB_PORT', default='5432'),
+            'POOL': DB_POOL_OPTIONS,
+        }
+    }
+
+# Read replicas (chat.routers): comma-separated host[:port] of PostgreSQL
+# standbys of the same database and credentials; each one becomes a
+# 'replicaN' alias. With DB_ENGINE=sqlite an entry adds an alias on the same
+# file (local testing of the routing).
+DB_REPLICA_HOSTS = config('DB_REPLICA_HOSTS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+for index, host in enumerate(DB_REPLICA_HOSTS, 1):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if DB_ENGINE != 'sqlite':
+        replica_host, _, replica_port = host.partition(':')
+        replica.update(HOST=replica_host, PORT=replica_port or replica['PORT'], OPTIONS={
+            'connect_timeout': config('DB_REPLICA_CONNECT_TIMEOUT', default=2, cast=int),
+        })
+    DATABASES[f'replica{index}'] = replica
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['chat.routers.ReplicaRouter']
+# After a write, the user's reads stay on the primary this long
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=5, cast=int)
+# A replica lagging more than this leaves the rotation until it catches up
+REPLICA_MAX_LAG_SECONDS = config('REPLICA_MAX_LAG_SECONDS', default=2.0, cast=float)
+REPLICA_CHECK_INTERVAL = config('REPLICA_CHECK_INTERVAL', default=5.0, cast=float)
+
+# Django cache shared by every worker and node (REDIS_URL, e.g.
+# redis://redis:6379/0): read-your-writes pins (chat.routers), login/register
+# throttles (chat.throttling) and the ETag generation counters
+# (chat.conditional). Without it each process has its own LocMemCache,
+# which is only coherent with a single worker process.
+REDIS_URL = config('REDIS_URL', default='')
+SHARED_CACHE = bool(REDIS_URL)
+if SHARED_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+            'KEY_PREFIX': 'chat',
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
 
 AUTH_USER_MODEL = 'chat.User'
 
@@ -98,7 +179,27 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_ROOT = config('MEDIA_ROOT', default=os.path.join(BASE_DIR, 'media'))
+
+# Message images are served by nginx from an internal location after
+# GET /messages/<id>/image has checked access (chat.media)
+MEDIA_BASE_URL = config('MEDIA_BASE_URL', default='https://10.111.46.149:8443')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+# Lifetime of signed private image URLs, in seconds
+MEDIA_URL_TTL = config('MEDIA_URL_TTL', default=3600, cast=int)
+
+# Maximum request body for multipart image uploads on POST /messages
+MESSAGE_UPLOAD_MAX_BYTES = config('MESSAGE_UPLOAD_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+# Most messages accepted by one POST /messages/batch
+MESSAGE_BATCH_MAX = config('MESSAGE_BATCH_MAX', default=100, cast=int)
+
+# 'content': images named by SHA-256 under images/ab/cd/, duplicates stored
+# once and reference counted (chat.storage); 'uuid': one random name per upload
+IMAGE_STORAGE_MODE = config('IMAGE_STORAGE_MODE', default='content')
+
+# Thumbnail/WebP variants rendered off the request path (chat.images)
+IMAGE_VARIANTS_ENABLED = config('IMAGE_VARIANTS_ENABLED', default=True, cast=bool)
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -110,6 +211,85 @@ REST_FRAMEWORK = {
 
 JWT_SECRET_KEY = config('JWT_SECRET_KEY', default='your-jwt-secret-key-change-in-production')
 
+# Per-process cache of users resolved by jwt_required (TTL 0 disables it)
+AUTH_USER_CACHE_SIZE = config('AUTH_USER_CACHE_SIZE', default=10000, cast=int)
+AUTH_USER_CACHE_TTL = config('AUTH_USER_CACHE_TTL', default=60, cast=int)
+# Tokens failing this many times are refused outright for AUTH_REJECT_TTL seconds
+AUTH_REJECT_THRESHOLD = config('AUTH_REJECT_THRESHOLD', default=3, cast=int)
+AUTH_REJECT_TTL = config('AUTH_REJECT_TTL', default=300, cast=int)
+
+# Password hashing executor used by login/register (per process)
+HASHING_CONCURRENCY = config('HASHING_CONCURRENCY', default=2, cast=int)
+HASHING_QUEUE_DEPTH = config('HASHING_QUEUE_DEPTH', default=8, cast=int)
+HASHING_TIMEOUT = config('HASHING_TIMEOUT', default=5, cast=float)
+
+# Login/register throttling (limit per window in seconds, 0 disables);
+# the limits apply per worker process without the shared cache (REDIS_URL)
+# X-Real-IP is the client key only behind nginx, which sets it
+# (docker-compose.https.yml): a client reaching gunicorn directly could send
+# a different one with every request.
+THROTTLE_TRUST_X_REAL_IP = config('THROTTLE_TRUST_X_REAL_IP', default=False, cast=bool)
+LOGIN_IP_LIMIT = config('LOGIN_IP_LIMIT', default=30, cast=int)
+LOGIN_IP_WINDOW = config('LOGIN_IP_WINDOW', default=60, cast=int)
+LOGIN_USERNAME_FAILURE_LIMIT = config('LOGIN_USERNAME_FAILURE_LIMIT', default=5, cast=int)
+LOGIN_USERNAME_WINDOW = config('LOGIN_USERNAME_WINDOW', default=900, cast=int)
+REGISTER_IP_LIMIT = config('REGISTER_IP_LIMIT', default=10, cast=int)
+REGISTER_IP_WINDOW = config('REGISTER_IP_WINDOW', default=3600, cast=int)
+
+# Messages feed pagination
+MESSAGES_PAGE_SIZE = config('MESSAGES_PAGE_SIZE', default=50, cast=int)
+MESSAGES_PAGE_MAX = config('MESSAGES_PAGE_MAX', default=200, cast=int)
+# Messages can commit slightly out of created_at order: ?since= cursors and
+# SSE replays stay this many seconds behind the newest message sent, which
+# is therefore sent again (clients dedupe by id)
+FEED_SETTLE_SECONDS = config('FEED_SETTLE_SECONDS', default=5, cast=int)
+
+# Messages older than this many days may be moved to the archive table by
+# `manage.py archive_messages`; feed pages past that age read both tables.
+# 0 disables archiving (and the archive reads).
+ARCHIVE_AFTER_DAYS = config('ARCHIVE_AFTER_DAYS', default=180, cast=int)
+ARCHIVE_BATCH_SIZE = config('ARCHIVE_BATCH_SIZE', default=5000, cast=int)
+
+# Per-process buffer of recent public messages, already serialized
+# (chat.timeline); PUBLIC_TIMELINE_SIZE=0 disables it. It is kept coherent
+# through the cache, so it is off by default without a shared one.
+PUBLIC_TIMELINE_SIZE = config('PUBLIC_TIMELINE_SIZE', default=1000 if SHARED_CACHE else 0, cast=int)
+PUBLIC_TIMELINE_MAX_BYTES = config('PUBLIC_TIMELINE_MAX_BYTES', default=2 * 1024 * 1024, cast=int)
+PUBLIC_TIMELINE_SETTLE_SECONDS = config('PUBLIC_TIMELINE_SETTLE_SECONDS', default=FEED_SETTLE_SECONDS, cast=int)
+
+# GET /users page size (?limit=) and cap; also the most ids= per request
+USERS_PAGE_SIZE = config('USERS_PAGE_SIZE', default=100, cast=int)
+USERS_PAGE_MAX = config('USERS_PAGE_MAX', default=500, cast=int)
+
+# Server-Sent Events (/messages/stream)
+SSE_NOTIFY_CHANNEL = config('SSE_NOTIFY_CHANNEL', default='chat_messages')
+SSE_HEARTBEAT_SECONDS = config('SSE_HEARTBEAT_SECONDS', default=15, cast=int)
+SSE_BUFFER_SIZE = config('SSE_BUFFER_SIZE', default=100, cast=int)
+SSE_REPLAY_LIMIT = config('SSE_REPLAY_LIMIT', default=200, cast=int)
+# Ids of the messages recently sent on one stream, never sent twice
+SSE_SENT_IDS = config('SSE_SENT_IDS', default=1000, cast=int)
+SSE_MAX_SECONDS = config('SSE_MAX_SECONDS', default=300, cast=int)
+SSE_RETRY_MS = config('SSE_RETRY_MS', default=3000, cast=int)
+# Under WSGI each open stream holds a gunicorn thread: at most this many per
+# worker process (keep it well below --threads), the next ones get a 503.
+# Not applied to the async view (ASGI), where a stream holds no thread.
+SSE_MAX_STREAMS = config('SSE_MAX_STREAMS', default=8, cast=int)
+
+# GET /metrics (chat.metrics): scrapers send 'Authorization: Bearer <token>'
+# when set. Multi-worker aggregation needs PROMETHEUS_MULTIPROC_DIR (env only).
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
+
+# Request profiling (chat.profiling): requests sent with X-Profile-Token, or
+# drawn at PROFILE_SAMPLE_RATE, are profiled (cProfile + SQL with EXPLAIN)
+# and stored under PROFILE_DIR, keeping the PROFILE_MAX_COUNT newest
+PROFILE_TOKEN = config('PROFILE_TOKEN', default='')
+PROFILE_SAMPLE_RATE = config('PROFILE_SAMPLE_RATE', default=0.0, cast=float)
+PROFILE_DIR = config('PROFILE_DIR', default='/app/logs/profiles')
+PROFILE_MAX_COUNT = config('PROFILE_MAX_COUNT', default=200, cast=int)
+PROFILE_EXPLAIN_LIMIT = config('PROFILE_EXPLAIN_LIMIT', default=50, cast=int)
+# Queries slower than this are logged with their route and user (0 disables)
+SLOW_QUERY_SECONDS = config('SLOW_QUERY_SECONDS', default=0.2, cast=float)
+
 # Spectacular (Swagger/OpenAPI) Configuration
 SPECTACULAR_SETTINGS = {
     'TITLE': 'ChatBot API',
@@ -172,6 +352,16 @@ SPECTACULAR_SETTINGS = {
 # ]
 
 # Logging Configuration
+# Logging: 'text' (readable lines) or 'structured' (one JSON line per
+# request, written by a background thread through a bounded queue, chat.log)
+LOG_MODE = config('LOG_MODE', default='text')
+LOG_FILE = config('LOG_FILE', default='/app/logs/api.log')
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+# Keep rates of structured access lines: 'route:2xx=0.1,2xx=0.5' (route =
+# URL name, e.g. messages, users); unlisted status classes are always kept
+LOG_SAMPLE_RATES = config('LOG_SAMPLE_RATES', default='')
+LOG_SLOW_SECONDS = config('LOG_SLOW_SECONDS', default=1.0, cast=float)
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -200,7 +390,7 @@ LOGGING = {
         },
         'file': {
             'class': 'logging.FileHandler',
-            'filename': '/app/logs/api.log',
+            'filename': LOG_FILE,
             'formatter': 'verbose',
         },
     },
@@ -235,4 +425,45 @@ LOGGING = {
             'propagate': False,
         },
     },
-}
\ No newline at end of file
+}
+
+if LOG_MODE == 'structured':
+    LOGGING = {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'formatters': {
+            'json': {
+                '()': 'chat.log.JsonFormatter',
+            },
+        },
+        'handlers': {
+            'queued': {
+                '()': 'chat.log.QueuedHandler',
+                'filename': LOG_FILE or None,
+                'queue_size': LOG_QUEUE_SIZE,
+                'formatter': 'json',
+            },
+        },
+        'root': {
+            'handlers': ['queued'],
+            'level': 'WARNING',
+        },
+        'loggers': {
+            'django': {
+                'handlers': ['queued'],
+                'level': 'WARNING',
+                'propagate': False,
+            },
+            # Per-step chat.* INFO/DEBUG lines are replaced by the access line
+            'chat': {
+                'handlers': ['queued'],
+                'level': 'WARNING',
+                'propagate': False,
+            },
+            'api_requests': {
+                'handlers': ['queued'],
+                'level': 'INFO',
+                'propagate': False,
+            },
+        },
+    }
@@ -0,0 +1,41 @@
+import gc
+import glob
+import os
+
+# Per-worker Prometheus sample files (chat.metrics); /metrics sums them
+PROMETHEUS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Django and the project are imported once, by the master: the workers share
+# those pages copy-on-write and start warm (see when_ready)
+preload_app = True
+
+# Each worker is replaced after this many requests, give or take the jitter
+# so they do not all restart together (slow memory growth). Open SSE streams
+# get graceful_timeout seconds, then reconnect to another worker.
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 500))
+
+
+def on_starting(server):
+    # Samples left by a previous master would be added to the new ones
+    if PROMETHEUS_MULTIPROC_DIR:
+        os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+        for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, '*.db')):
+            os.remove(path)
+
+
+def when_ready(server):
+    # Master, app loaded, no worker forked yet. Fails the boot (RuntimeError)
+    # when the database has unapplied migrations.
+    from chat.warmup import warm_up
+    warm_up()
+    # Keep the garbage collector from writing to (and so un-sharing) the
+    # pages of everything imported so far
+    gc.freeze()
+
+
+def child_exit(server, worker):
+    # Drop the in-flight gauge of a dead worker; its counters are kept
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)